@@ -0,0 +1,268 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+from datetime import datetime, timezone
+
+import numpy as np
+
+from encoder import NUMERIC_FEATURES
+
+ARTIFACT_PATH = 'model.bin'
+MAGIC = b'CARPRICE'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+# magic, format version, header length
+PREAMBLE = struct.Struct('<8sII')
+GBM_ARRAYS = ['feature', 'threshold', 'left', 'right', 'value', 'missing_left', 'roots']
+
+
+class ArtifactError(ValueError):
+    pass
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class ModelArtifact:
+    """A single-file model: JSON header followed by raw, aligned arrays.
+
+    Layout::
+
+        CARPRICE | u32 format version | u32 header length | JSON header
+        | padding | array bytes (each 64-byte aligned) ...
+
+    The header carries the feature vocabulary, model parameters, training
+    metadata and the dtype/shape/offset/sha256 of every array. Arrays are
+    returned as read-only views over a memory map, so loading costs one JSON
+    parse regardless of model size.
+    """
+
+    def __init__(self, header, arrays, path=None):
+        self.header = header
+        self.arrays = arrays
+        self.path = path
+
+    @property
+    def vocabulary(self):
+        return self.header['vocabulary']
+
+    @property
+    def model(self):
+        return self.header['model']
+
+    @property
+    def metadata(self):
+        return self.header['metadata']
+
+    @property
+    def version(self):
+        return self.header['version']
+
+    def checked_array(self, name):
+        # Lazy arrays skip the checksum at load time; callers verify each one
+        # on first use instead, so untouched arrays are never paged in
+        array = self.arrays[name]
+        if hashlib.sha256(array).hexdigest() != self.header['arrays'][name]['sha256']:
+            raise ArtifactError(f"array '{name}' in {self.path} failed its checksum")
+        return array
+
+    def validate(self):
+        vocabulary = self.vocabulary
+        if len(set(vocabulary)) != len(vocabulary):
+            raise ArtifactError("feature vocabulary contains duplicates")
+        if vocabulary[:len(NUMERIC_FEATURES)] != NUMERIC_FEATURES:
+            raise ArtifactError(f"vocabulary must start with {NUMERIC_FEATURES}")
+        if self.model.get('kind') == 'linear':
+            coef = self.arrays.get('coef')
+            if coef is None:
+                raise ArtifactError("linear artifact has no 'coef' array")
+            if coef.shape != (len(vocabulary),):
+                raise ArtifactError(f"coef has shape {coef.shape} but the vocabulary has "
+                                    f"{len(vocabulary)} features")
+            if not np.isfinite(coef).all() or not np.isfinite(self.model['intercept']):
+                raise ArtifactError("model parameters contain NaN or infinity")
+        elif self.model.get('kind') == 'gbm':
+            missing = [name for name in GBM_ARRAYS if name not in self.arrays]
+            if missing:
+                raise ArtifactError(f"gbm artifact is missing arrays {missing}")
+            n_nodes = len(self.arrays['feature'])
+            if any(len(self.arrays[name]) != n_nodes for name in GBM_ARRAYS if name != 'roots'):
+                raise ArtifactError("gbm node arrays differ in length")
+            for name in ('left', 'right', 'roots'):
+                if len(self.arrays[name]) and not (0 <= self.arrays[name].min() <= self.arrays[name].max() < n_nodes):
+                    raise ArtifactError(f"gbm '{name}' points outside the {n_nodes} nodes")
+            if n_nodes and not (0 <= self.arrays['feature'].min() <= self.arrays['feature'].max() < len(vocabulary)):
+                raise ArtifactError(f"gbm splits on features outside the {len(vocabulary)}-feature vocabulary")
+            if not np.isfinite(self.arrays['value']).all() or not np.isfinite(self.model['baseline']):
+                raise ArtifactError("model parameters contain NaN or infinity")
+        elif self.model.get('kind') == 'segmented':
+            # Shapes only: segment coefficients are checked as each one is loaded
+            segments = self.model['segments']
+            if len(self.model['intercepts']) != len(segments):
+                raise ArtifactError("segmented artifact has one intercept per segment")
+            for i in range(len(segments)):
+                coef = self.arrays.get(f'coef_{i}')
+                if coef is None or coef.shape != (len(vocabulary),):
+                    raise ArtifactError(f"segment {segments[i]!r} has no coefficients matching the vocabulary")
+            if not np.isfinite(self.model['intercepts']).all():
+                raise ArtifactError("model parameters contain NaN or infinity")
+        return self
+
+
+def _content_version(vocabulary, arrays, model, intervals=None):
+    # Everything that changes what is served: the parameters and the interval
+    # calibration, so a recalibrated artifact is a new version. Other metadata
+    # (timestamps, training reports) is left out
+    digest = hashlib.sha256()
+    digest.update(json.dumps([vocabulary, model] + ([intervals] if intervals else []),
+                             sort_keys=True).encode('utf-8'))
+    for name in sorted(arrays):
+        digest.update(name.encode('utf-8'))
+        digest.update(np.ascontiguousarray(arrays[name]).tobytes())
+    return digest.hexdigest()[:12]
+
+
+def save_artifact(path, vocabulary, arrays, model, metadata=None, lazy=()):
+    arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+    metadata = dict(metadata or {})
+    metadata.setdefault('created_at', datetime.now(timezone.utc).isoformat(timespec='seconds'))
+
+    specs = {}
+    offset = 0
+    for name, a in arrays.items():
+        specs[name] = {
+            'dtype': a.dtype.str,
+            'shape': list(a.shape),
+            'offset': offset,
+            'nbytes': a.nbytes,
+            'sha256': hashlib.sha256(a.tobytes()).hexdigest(),
+        }
+        if name in lazy:
+            specs[name]['lazy'] = True
+        offset = _align(offset + a.nbytes)
+
+    header = {
+        'format': 'car-price-model',
+        'version': _content_version(list(vocabulary), arrays, model, metadata.get('intervals')),
+        'model': model,
+        'vocabulary': list(vocabulary),
+        'metadata': metadata,
+        'arrays': specs,
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _align(PREAMBLE.size + len(header_bytes))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b'\0' * (data_start - PREAMBLE.size - len(header_bytes)))
+        for name, a in arrays.items():
+            f.seek(data_start + specs[name]['offset'])
+            f.write(a.tobytes())
+        f.truncate(data_start + offset)
+    # Readers either see the old file or the complete new one, never a torn write
+    os.replace(tmp_path, path)
+    return header
+
+
+def load_artifact(path=ARTIFACT_PATH, verify=True):
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(buffer) < PREAMBLE.size:
+        raise ArtifactError(f"{path} is too small to be a model artifact")
+    magic, format_version, header_length = PREAMBLE.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ArtifactError(f"{path} is not a car price model artifact")
+    if format_version != FORMAT_VERSION:
+        raise ArtifactError(f"{path} has format version {format_version}, expected {FORMAT_VERSION}")
+
+    header_end = PREAMBLE.size + header_length
+    header = json.loads(bytes(buffer[PREAMBLE.size:header_end]).decode('utf-8'))
+    data_start = _align(header_end)
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        start = data_start + spec['offset']
+        end = start + spec['nbytes']
+        if end > len(buffer):
+            raise ArtifactError(f"array '{name}' runs past the end of {path}")
+        view = memoryview(buffer)[start:end]
+        if verify and not spec.get('lazy') and hashlib.sha256(view).hexdigest() != spec['sha256']:
+            raise ArtifactError(f"array '{name}' in {path} failed its checksum")
+        arrays[name] = np.frombuffer(view, dtype=np.dtype(spec['dtype'])).reshape(spec['shape'])
+
+    artifact = ModelArtifact(header, arrays, path)
+    return artifact.validate() if verify else artifact
+
+
+def save_linear_model(path, columns, coef, intercept, metadata=None, target='price', name_encoding='full'):
+    model = {'kind': 'linear', 'intercept': float(intercept), 'target': target, 'name_encoding': name_encoding}
+    return save_artifact(path, columns, {'coef': np.asarray(coef, dtype='<f8').ravel()}, model, metadata)
+
+
+def save_gbm_model(path, columns, trees, baseline, max_depth, categories, metadata=None, target='log'):
+    # Trees are stored as the flat node arrays TreeScorer evaluates; the
+    # category orders fix what each integer code means
+    model = {'kind': 'gbm', 'baseline': float(baseline), 'max_depth': int(max_depth), 'target': target,
+             'categories': categories}
+    return save_artifact(path, columns, {name: np.asarray(trees[name]) for name in GBM_ARRAYS}, model, metadata)
+
+
+def save_segmented_model(path, columns, segments, coefs, intercepts, brand_groups, metadata=None,
+                         target='log', name_encoding='hashed'):
+    # One coefficient array per segment, all over the same vocabulary and
+    # marked lazy, so a router maps the file once and pages in only the
+    # segments it actually serves
+    model = {'kind': 'segmented', 'segments': list(segments), 'intercepts': [float(i) for i in intercepts],
+             'brand_groups': brand_groups, 'target': target, 'name_encoding': name_encoding}
+    arrays = {f'coef_{i}': np.asarray(coef, dtype='<f8').ravel() for i, coef in enumerate(coefs)}
+    return save_artifact(path, columns, arrays, model, metadata, lazy=set(arrays))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect model artifacts or convert a legacy model.pkl/columns.pkl pair.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    inspect = sub.add_parser('inspect', help="Validate an artifact and print its header")
+    inspect.add_argument('path', nargs='?', default=ARTIFACT_PATH)
+
+    convert = sub.add_parser('convert', help="Convert a pickled LinearRegression and its column list")
+    convert.add_argument('--model', default='model.pkl')
+    convert.add_argument('--columns', default='columns.pkl')
+    convert.add_argument('--output', default=ARTIFACT_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == 'inspect':
+        artifact = load_artifact(args.path)
+        summary = {k: v for k, v in artifact.header.items() if k != 'vocabulary'}
+        summary['features'] = len(artifact.vocabulary)
+        print(json.dumps(summary, indent=2))
+        return
+
+    import pickle as pk
+    with open(args.model, 'rb') as f:
+        model = pk.load(f)
+    with open(args.columns, 'rb') as f:
+        columns = pk.load(f)
+    header = save_linear_model(args.output, columns, model.coef_, model.intercept_, {
+        'source': os.path.basename(args.model),
+        'model_sha256': file_sha256(args.model),
+    })
+    print(f" Converted {args.model} + {args.columns} -> {args.output} (version {header['version']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import time
+
+import numpy as np
+
+from encoder import INPUT_FIELDS
+from ingest import read_listings, write_listings
+from metrics import METRICS, profiled
+from model_store import load_models, predict, MODEL_PATH
+
+DEFAULT_CHUNK_SIZE = 50000
+
+
+def predict_frame(frame, model, encoder, chunk_size=DEFAULT_CHUNK_SIZE):
+    missing = [col for col in INPUT_FIELDS if col not in frame.columns]
+    if missing:
+        raise ValueError(f"Input is missing required columns: {', '.join(missing)}")
+
+    predictions = np.empty(len(frame))
+    for start in range(0, len(frame), chunk_size):
+        chunk = frame.iloc[start:start + chunk_size]
+        with METRICS.stage('encode', path='batch'):
+            X = encoder.transform(chunk, sparse=True)
+        with METRICS.stage('inference', path='batch'):
+            predictions[start:start + len(chunk)] = predict(model, X)
+    METRICS.inc('predictions_total', len(frame), path='batch')
+    return predictions
+
+
+def predict_intervals(frame, model, chunk_size=DEFAULT_CHUNK_SIZE):
+    # (low, high) columns from the residual quantiles stored in the artifact
+    low, high = np.empty(len(frame)), np.empty(len(frame))
+    for start in range(0, len(frame), chunk_size):
+        chunk = frame.iloc[start:start + chunk_size]
+        low[start:start + len(chunk)], high[start:start + len(chunk)] = model.interval_frame(chunk)
+    return low, high
+
+
+def predict_file(input_path, output_path, model_path=MODEL_PATH,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+    model, _ = load_models(model_path)
+    encoder = model.make_encoder()
+    with METRICS.stage('load_data', path='batch'):
+        frame = read_listings(input_path)
+
+    started = time.perf_counter()
+    frame['predicted_price'] = predict_frame(frame, model, encoder, chunk_size)
+    if model.intervals:
+        frame['price_low'], frame['price_high'] = predict_intervals(frame, model, chunk_size)
+    elapsed = time.perf_counter() - started
+
+    write_listings(frame, output_path)
+    return {
+        'rows': len(frame),
+        'seconds': elapsed,
+        'rows_per_sec': len(frame) / elapsed if elapsed > 0 else float('inf'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Price every car in a CSV or Parquet listings file.")
+    parser.add_argument('input', help="CSV or Parquet file shaped like cardetails.csv.csv")
+    parser.add_argument('output', help="Where to write the listings with predicted_price (and price_low/price_high) columns")
+    parser.add_argument('--model', default=MODEL_PATH, help="Model artifact to score with")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Rows encoded and scored per model.predict call")
+    parser.add_argument('--profile', action='store_true',
+                        help="Profile the run with cProfile and tracemalloc and print the hot spots")
+    parser.add_argument('--metrics', help="Write stage timings in Prometheus text format to this file")
+    args = parser.parse_args(argv)
+
+    with profiled(args.profile) as profile:
+        stats = predict_file(args.input, args.output, args.model, args.chunk_size)
+    print(f" Priced {stats['rows']:,} cars in {stats['seconds']:.3f}s "
+          f"({stats['rows_per_sec']:,.0f} rows/sec) -> {args.output}")
+    if profile:
+        print(profile['cpu'])
+        print(f" Peak traced memory {profile['peak_bytes'] / 2 ** 20:.1f} MiB; top allocations:")
+        for line in profile['allocations'][:10]:
+            print(f"   {line}")
+    if args.metrics:
+        METRICS.dump(args.metrics)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+import warnings
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import ingest
+import model_store
+from batch_predict import predict_frame
+from encoder import INPUT_FIELDS
+from train_model import train_full
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+BATCH_SIZES = [1, 100, 10000]
+
+
+def synthetic_listings(size, seed=0, csv_path=ingest.CSV_PATH):
+    # Resample real listings and jitter year/km so the category mix and
+    # vocabulary stay realistic while the row count scales up
+    rng = np.random.default_rng(seed)
+    base = pd.read_csv(csv_path)
+    frame = base.iloc[rng.integers(0, len(base), size)].reset_index(drop=True)
+    frame['year'] = np.clip(frame['year'] + rng.integers(-1, 2, size), base['year'].min(), base['year'].max())
+    frame['km_driven'] = np.maximum(0, frame['km_driven'] + rng.integers(-5000, 5001, size))
+    frame['selling_price'] = np.maximum(
+        10000, (frame['selling_price'] * rng.normal(1.0, 0.05, size)).round()).astype(np.int64)
+    return frame
+
+
+def legacy_encode(row, columns):
+    # The encoding block car_price_prediction.py used before FeatureEncoder
+    frame = pd.DataFrame([row], columns=INPUT_FIELDS)
+    frame['owner'] = frame['owner'].replace(['Third Owner', 'Test Drive Car'], [4, 5])
+    encoded = pd.get_dummies(frame)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', pd.errors.PerformanceWarning)
+        for col in columns:
+            if col not in encoded.columns:
+                encoded[col] = 0
+    return encoded[columns]
+
+
+def measure(fn, repeat, rows=1):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples = np.array(samples)
+    p50 = float(np.percentile(samples, 50))
+    return {
+        'repeat': repeat,
+        'rows': rows,
+        'p50_ms': p50 * 1000,
+        'p99_ms': float(np.percentile(samples, 99)) * 1000,
+        'mean_ms': float(samples.mean()) * 1000,
+        'rows_per_sec': rows / p50 if p50 > 0 else float('inf'),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes=DEFAULT_SIZES, repeat=50, train=True, seed=0):
+    results = {}
+    car = dict(zip(INPUT_FIELDS, ['Maruti Swift Dzire VDI', 2015, 60000, 'Diesel', 'Individual',
+                                  'Manual', 'First Owner']))
+
+    results['load_models'] = measure(model_store.load_models, repeat)
+    model, columns = model_store.load_models()
+    encoder = model.make_encoder()
+
+    # The legacy path takes seconds per call, so it gets far fewer repetitions
+    results['encode/legacy'] = measure(lambda: legacy_encode([car[f] for f in INPUT_FIELDS], columns),
+                                       max(3, repeat // 10))
+    results['encode/feature_encoder'] = measure(lambda: encoder.encode_one(**car), repeat * 20)
+    results['encode/feature_encoder_sparse'] = measure(lambda: encoder.encode_one(sparse=True, **car), repeat * 20)
+
+    results['predict/single_scorer'] = measure(lambda: model.price(**car), repeat * 100)
+    row = encoder.encode_one(**car)
+    results['predict/single_row'] = measure(lambda: model.predict(row), repeat * 20)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            frame = synthetic_listings(size, seed)
+            csv_path = os.path.join(tmp, f'listings_{size}.csv')
+            arrow_path = os.path.join(tmp, f'listings_{size}.arrow')
+            frame.to_csv(csv_path, index=False)
+            runs = max(3, repeat // 10)
+
+            results[f'load_data/csv/{size}'] = measure(lambda: pd.read_csv(csv_path), runs, size)
+            results[f'load_data/ingest/{size}'] = measure(lambda: ingest.convert(csv_path, arrow_path), runs, size)
+            results[f'load_data/arrow/{size}'] = measure(
+                lambda: ingest.load_listings(INPUT_FIELDS, arrow_path, csv_path), runs, size)
+
+            for batch in BATCH_SIZES:
+                if batch <= size:
+                    chunk = frame.iloc[:batch]
+                    results[f'predict/batch/{size}/{batch}'] = measure(
+                        lambda: predict_frame(chunk, model, encoder), runs, batch)
+            results[f'predict/batch/{size}/all'] = measure(lambda: predict_frame(frame, model, encoder), runs, size)
+
+            if train:
+                results[f'train/full/{size}'] = measure(lambda: train_full(frame), 3, size)
+    return results
+
+
+def compare(results, baseline, threshold=0.2):
+    # A benchmark regresses when its p50 grew by more than `threshold`
+    regressions = {}
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous and previous['p50_ms'] > 0:
+            change = current['p50_ms'] / previous['p50_ms'] - 1
+            if change > threshold:
+                regressions[name] = {'before_ms': previous['p50_ms'], 'after_ms': current['p50_ms'],
+                                     'change': change}
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the load, encode, predict and train hot paths.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="Synthetic dataset sizes, resampled from cardetails.csv.csv")
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--no-train', action='store_true', help="Skip the training pipeline benchmarks")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="Previous results JSON to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Relative p50 slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat, not args.no_train, args.seed)
+    report = {
+        'commit': git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'sizes': args.sizes,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    width = max(len(name) for name in results)
+    for name, r in results.items():
+        print(f"{name:<{width}}  p50 {r['p50_ms']:10.3f} ms  p99 {r['p99_ms']:10.3f} ms  "
+              f"{r['rows_per_sec']:14,.0f} rows/s")
+    print(f" Saved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, r in regressions.items():
+            print(f" REGRESSION {name}: {r['before_ms']:.3f} -> {r['after_ms']:.3f} ms ({r['change']:+.0%})")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,43 @@
-import pandas as pd
-import numpy as np
-import pickle as pk
+import time
+_run_started = time.perf_counter()
+
+import logging
+import os
 import streamlit as st
 from datetime import datetime
+from model_registry import LOG_FORMAT, ModelRegistry
+import catalog as catalog_store
+import price_table as price_table_store
+from prediction_cache import PredictionCache
+import what_if
+import comparables
+from metrics import METRICS, METRICS_PATH, RequestProfiler, track_cache
+
+# pandas, pyarrow and scipy are deliberately not imported here: the dropdowns
+# come from a small JSON sidecar and single predictions need only numpy, so a
+# cold replica can render without loading the data stack
+_imports_done = time.perf_counter()
+logger = logging.getLogger(__name__)
+# Streamlit only gives its own loggers a handler, so the app's INFO lines
+# (active model version, swaps, cold start) would otherwise be dropped
+APP_LOGGERS = (__name__, 'model_registry', 'price_table', 'segments')
+_LOG_HANDLER = 'car-price-app'
+
+
+def configure_logging():
+    # Runs on every rerun of the script, so the handler is added only once
+    for name in APP_LOGGERS:
+        app_logger = logging.getLogger(name)
+        app_logger.setLevel(logging.INFO)
+        if not any(handler.get_name() == _LOG_HANDLER for handler in app_logger.handlers):
+            handler = logging.StreamHandler()
+            handler.set_name(_LOG_HANDLER)
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            app_logger.addHandler(handler)
+            app_logger.propagate = False
+
+
+configure_logging()
 
 # Page configuration
 st.set_page_config(
@@ -208,20 +243,63 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Load models and data
+@track_cache(st.cache_resource)
+def load_registry():
+    # One registry per process; its watcher thread validates and swaps in a
+    # retrained model.bin in the background, so daily retrains need no restart
+    return ModelRegistry()
+
+@track_cache(st.cache_resource)
+def load_catalog():
+    # Brand list, dropdown options and year range from catalog.json; the
+    # listings are only read to rebuild it when the CSV has changed
+    return catalog_store.load_or_build_catalog()
+
 @st.cache_resource
-def load_models():
-    model = pk.load(open('model.pkl', 'rb'))
-    columns = pk.load(open('columns.pkl', 'rb'))
-    return model, columns
+def startup_timings():
+    # Filled in by the first run of this process, i.e. the cold start
+    return {}
+
+@track_cache(st.cache_resource)
+def load_comparables():
+    # Built on the first prediction rather than at startup, since it needs the listings
+    return comparables.load_comparables()
+
+@track_cache(st.cache_resource)
+def load_price_tables():
+    # Precomputed by `python price_table.py` and reloaded whenever it is
+    # rebuilt; current() is None if it has not been built
+    return price_table_store.PriceTableWatcher()
 
-@st.cache_data
-def load_data():
-    car_data = pd.read_csv('cardetails.csv.csv')
-    car_data['name'] = car_data['name'].apply(lambda x: x.split(' ')[0].strip())
-    return car_data
+@track_cache(st.cache_resource)
+def load_prediction_cache(_registry):
+    # Shared across sessions; cleared automatically when the registry swaps models
+    return PredictionCache(signature=lambda: _registry.version)
 
-model, columns = load_models()
-car_data = load_data()
+with METRICS.stage('load_model'):
+    registry = load_registry()
+    # One model per script run: a swap mid-run only affects the next run
+    model = registry.current()
+_models_loaded = time.perf_counter()
+prediction_cache = load_prediction_cache(registry)
+# Loaded with the model rather than on the first PREDICT click; like the
+# model, one table per script run
+price_table = load_price_tables().current()
+with METRICS.stage('load_catalog'):
+    catalog = load_catalog()
+_catalog_loaded = time.perf_counter()
+METRICS.set_gauge('encoded_feature_width', len(model.columns), model_version=model.version)
+
+cold_start = startup_timings()
+if not cold_start:
+    cold_start.update({
+        'imports_ms': (_imports_done - _run_started) * 1000,
+        'model_ms': (_models_loaded - _imports_done) * 1000,
+        'catalog_ms': (_catalog_loaded - _models_loaded) * 1000,
+        'total_ms': (_catalog_loaded - _run_started) * 1000,
+    })
+    logger.info("Cold start: imports %.0f ms, model %.0f ms, catalog %.0f ms (total %.0f ms)",
+                cold_start['imports_ms'], cold_start['model_ms'], cold_start['catalog_ms'], cold_start['total_ms'])
 
 # Header
 st.markdown("<h1>🚗 Car Price Prediction System</h1>", unsafe_allow_html=True)
@@ -250,397 +328,512 @@ with st.sidebar:
     st.markdown("<h2 style='color: #a78bfa; margin-top: 30px;'>📈 Model Statistics</h2>", unsafe_allow_html=True)
     col_s1, col_s2 = st.columns(2)
     with col_s1:
-        st.metric("Total Cars", f"{len(car_data):,}")
+        st.metric("Total Cars", f"{catalog.n_rows:,}")
     with col_s2:
-        st.metric("Brands", len(car_data['name'].unique()))
+        st.metric("Brands", catalog.n_brands)
     
     st.markdown("<h2 style='color: #a78bfa; margin-top: 30px;'>💡 Tips</h2>", unsafe_allow_html=True)
     st.success("✅ Lower km driven = Higher price!")
     st.info("ℹ️ First owner cars have better resale value")
     st.warning("⚠️ Regular maintenance increases value")
+    
+    st.caption(f"⏱️ Cold start {cold_start['total_ms']:.0f} ms (imports {cold_start['imports_ms']:.0f} · "
+               f"model {cold_start['model_ms']:.0f} · catalog {cold_start['catalog_ms']:.0f})")
+    st.caption(f"🧠 Model version {model.version}"
+               + (f" · {registry.swaps} hot swaps" if registry.swaps else ""))
+    if registry.last_error:
+        st.caption(f"⚠️ Latest model.bin rejected: {registry.last_error}")
 
-# Main content
-col1, col2 = st.columns([2.5, 1.5])
+# Widget keys shared between fragments through st.session_state
+CAR_FIELDS = ['name', 'year', 'km_driven', 'fuel', 'seller_type', 'transmission', 'owner']
+DETAIL_FIELDS = CAR_FIELDS + ['location', 'condition']
 
-with col1:
-    st.markdown("<div class='section-header'>🔍 Enter Car Details</div>", unsafe_allow_html=True)
-    
-    # Input fields in columns
-    input_col1, input_col2, input_col3 = st.columns(3)
-    
-    with input_col1:
-        name = st.selectbox('🏢 Car Brand', sorted(car_data['name'].unique()), 
-                           help="Select the manufacturer of your car")
-        fuel = st.selectbox('⛽ Fuel Type', car_data['fuel'].unique(),
-                           help="Type of fuel your car uses")
-        location = st.selectbox('📍 Location', 
-                               ['Delhi', 'Mumbai', 'Bangalore', 'Hyderabad', 'Chennai', 
-                                'Kolkata', 'Pune', 'Ahmedabad', 'Jaipur', 'Surat', 'Other'],
-                               help="City where the car is located")
-    
-    with input_col2:
-        year = st.slider('📅 Model Year', 
-                        min_value=int(car_data['year'].min()), 
-                        max_value=int(car_data['year'].max()),
-                        value=2018,
-                        help="Year when the car was manufactured")
-        seller_type = st.selectbox('👤 Seller Type', car_data['seller_type'].unique(),
-                                  help="Type of seller")
-        condition = st.selectbox('🔧 Car Condition',
-                                ['Excellent', 'Good', 'Fair', 'Poor'],
-                                help="Overall condition of the vehicle")
-    
-    with input_col3:
-        km_driven = st.number_input('🛣️ Kilometers Driven', 
-                                    min_value=0, 
-                                    max_value=500000, 
-                                    value=50000,
-                                    step=1000,
-                                    help="Total distance covered")
-        transmission = st.selectbox('⚙️ Transmission', car_data['transmission'].unique(),
-                                   help="Type of transmission system")
-        owner = st.selectbox('👥 Owner Type', car_data['owner'].unique(),
-                            help="Number of previous owners")
+# Each section below is a fragment: a widget change reruns only the fragment
+# that owns the widget, not the CSS, sidebar and every other section. Inputs
+# reach the prediction fragment through st.session_state, and its results
+# are stored there too, so a later rerun redraws them without recomputing.
+@st.fragment
+def car_details():
+    col1, col2 = st.columns([2.5, 1.5])
 
-with col2:
-    st.markdown("<div class='section-header'>📝 Summary</div>", unsafe_allow_html=True)
-    st.markdown(f"""
-    <div class='summary-card'>
-        <div class='summary-item'>
-            <span class='summary-label'>🏢 Brand:</span>
-            <span class='summary-value'>{name}</span>
-        </div>
-        <div class='summary-item'>
-            <span class='summary-label'>📅 Year:</span>
-            <span class='summary-value'>{year}</span>
-        </div>
-        <div class='summary-item'>
-            <span class='summary-label'>🛣️ KM Driven:</span>
-            <span class='summary-value'>{km_driven:,} km</span>
-        </div>
-        <div class='summary-item'>
-            <span class='summary-label'>⛽ Fuel:</span>
-            <span class='summary-value'>{fuel}</span>
-        </div>
-        <div class='summary-item'>
-            <span class='summary-label'>⚙️ Transmission:</span>
-            <span class='summary-value'>{transmission}</span>
-        </div>
-        <div class='summary-item'>
-            <span class='summary-label'>👥 Owner:</span>
-            <span class='summary-value'>{owner}</span>
-        </div>
-        <div class='summary-item'>
-            <span class='summary-label'>📍 Location:</span>
-            <span class='summary-value'>{location}</span>
-        </div>
-        <div class='summary-item'>
-            <span class='summary-label'>🔧 Condition:</span>
-            <span class='summary-value'>{condition}</span>
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
-
-# Purchase Price Comparison Section
-st.markdown("---")
-st.markdown("<div class='section-header'>💰 Purchase Price Analysis (Optional)</div>", unsafe_allow_html=True)
+    with col1:
+        st.markdown("<div class='section-header'>🔍 Enter Car Details</div>", unsafe_allow_html=True)
+        
+        # Input fields in columns
+        input_col1, input_col2, input_col3 = st.columns(3)
+        
+        with input_col1:
+            name = st.selectbox('🏢 Car Brand', catalog.brands, key='name',
+                               help="Select the manufacturer of your car")
+            fuel = st.selectbox('⛽ Fuel Type', catalog.categories['fuel'], key='fuel',
+                               help="Type of fuel your car uses")
+            location = st.selectbox('📍 Location', 
+                                   ['Delhi', 'Mumbai', 'Bangalore', 'Hyderabad', 'Chennai', 
+                                    'Kolkata', 'Pune', 'Ahmedabad', 'Jaipur', 'Surat', 'Other'],
+                                   key='location',
+                                   help="City where the car is located")
+        
+        with input_col2:
+            year = st.slider('📅 Model Year', 
+                            min_value=catalog.year_min, 
+                            max_value=catalog.year_max,
+                            value=2018,
+                            key='year',
+                            help="Year when the car was manufactured")
+            seller_type = st.selectbox('👤 Seller Type', catalog.categories['seller_type'], key='seller_type',
+                                      help="Type of seller")
+            condition = st.selectbox('🔧 Car Condition',
+                                    ['Excellent', 'Good', 'Fair', 'Poor'],
+                                    key='condition',
+                                    help="Overall condition of the vehicle")
+        
+        with input_col3:
+            km_driven = st.number_input('🛣️ Kilometers Driven', 
+                                        min_value=0, 
+                                        max_value=500000, 
+                                        value=50000,
+                                        step=1000,
+                                        key='km_driven',
+                                        help="Total distance covered")
+            transmission = st.selectbox('⚙️ Transmission', catalog.categories['transmission'], key='transmission',
+                                       help="Type of transmission system")
+            owner = st.selectbox('👥 Owner Type', catalog.categories['owner'], key='owner',
+                                help="Number of previous owners")
 
-compare_price = st.checkbox("📊 Compare with my purchase price", help="Enable this to see how your car's value has changed")
+    with col2:
+        st.markdown("<div class='section-header'>📝 Summary</div>", unsafe_allow_html=True)
+        st.markdown(f"""
+        <div class='summary-card'>
+            <div class='summary-item'>
+                <span class='summary-label'>🏢 Brand:</span>
+                <span class='summary-value'>{name}</span>
+            </div>
+            <div class='summary-item'>
+                <span class='summary-label'>📅 Year:</span>
+                <span class='summary-value'>{year}</span>
+            </div>
+            <div class='summary-item'>
+                <span class='summary-label'>🛣️ KM Driven:</span>
+                <span class='summary-value'>{km_driven:,} km</span>
+            </div>
+            <div class='summary-item'>
+                <span class='summary-label'>⛽ Fuel:</span>
+                <span class='summary-value'>{fuel}</span>
+            </div>
+            <div class='summary-item'>
+                <span class='summary-label'>⚙️ Transmission:</span>
+                <span class='summary-value'>{transmission}</span>
+            </div>
+            <div class='summary-item'>
+                <span class='summary-label'>👥 Owner:</span>
+                <span class='summary-value'>{owner}</span>
+            </div>
+            <div class='summary-item'>
+                <span class='summary-label'>📍 Location:</span>
+                <span class='summary-value'>{location}</span>
+            </div>
+            <div class='summary-item'>
+                <span class='summary-label'>🔧 Condition:</span>
+                <span class='summary-value'>{condition}</span>
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
 
-purchase_price = None
-purchase_year = None
+@st.fragment
+def purchase_details():
+    # Purchase Price Comparison Section
+    st.markdown("---")
+    st.markdown("<div class='section-header'>💰 Purchase Price Analysis (Optional)</div>", unsafe_allow_html=True)
+    
+    compare_price = st.checkbox("📊 Compare with my purchase price", key='compare_price',
+                                help="Enable this to see how your car's value has changed")
+    
+    if compare_price:
+        # Defaults follow the car details as they were when this section last ran
+        year = st.session_state['year']
+        km_driven = st.session_state['km_driven']
+        purchase_col1, purchase_col2, purchase_col3 = st.columns(3)
+        with purchase_col1:
+            st.number_input('💵 Purchase Price (₹)', 
+                            min_value=0, 
+                            value=500000,
+                            step=10000,
+                            key='purchase_price',
+                            help="How much did you pay for this car?")
+        with purchase_col2:
+            st.number_input('📅 Year of Purchase', 
+                            min_value=2000, 
+                            max_value=datetime.now().year,
+                            value=min(year + 1, datetime.now().year),
+                            key='purchase_year',
+                            help="When did you buy this car?")
+        with purchase_col3:
+            st.number_input('🛣️ KM at Purchase', 
+                            min_value=0, 
+                            max_value=km_driven,
+                            value=max(0, km_driven - 20000),
+                            step=1000,
+                            key='purchase_km',
+                            help="Odometer reading when you bought it")
 
-if compare_price:
-    purchase_col1, purchase_col2, purchase_col3 = st.columns(3)
-    with purchase_col1:
-        purchase_price = st.number_input('💵 Purchase Price (₹)', 
-                                        min_value=0, 
-                                        value=500000,
-                                        step=10000,
-                                        help="How much did you pay for this car?")
-    with purchase_col2:
-        purchase_year = st.number_input('📅 Year of Purchase', 
-                                       min_value=2000, 
-                                       max_value=datetime.now().year,
-                                       value=min(year + 1, datetime.now().year),
-                                       help="When did you buy this car?")
-    with purchase_col3:
-        purchase_km = st.number_input('🛣️ KM at Purchase', 
-                                     min_value=0, 
-                                     max_value=km_driven,
-                                     value=max(0, km_driven - 20000),
-                                     step=1000,
-                                     help="Odometer reading when you bought it")
+def predict_car(model, details, purchase):
+    """Everything the results section shows, computed once per PREDICT click."""
+    car = {field: details[field] for field in CAR_FIELDS}
+    with st.spinner('🔄 Analyzing car details and calculating price...'):
+        # Common configurations come straight from the precomputed table, as
+        # long as it was built for this model version
+        with METRICS.stage('price_table'):
+            answer = price_table.lookup(model.version, **car) if price_table is not None else None
+        if answer is not None:
+            car_price, price_interval = answer
+        else:
+            # Predict: intercept + year/km terms + one coefficient per category,
+            # answered from the cache for configurations that were priced before
+            with METRICS.stage('inference'):
+                car_price = prediction_cache.get_or_compute(model.price, version=model.version, **car)
+            # Calibrated from holdout residuals for the car's brand, stored in the model artifact
+            with METRICS.stage('interval'):
+                price_interval = model.price_interval(**car)
+        # What-if sweep: every year x km combination priced in one call
+        sweep_years = list(range(catalog.year_min, catalog.year_max + 1))
+        sweep_kms = what_if.DEFAULT_KM_VALUES
+        with METRICS.stage('what_if'):
+            price_grid = what_if.price_grid(
+                model, {field: car[field] for field in ('name', 'fuel', 'seller_type', 'transmission', 'owner')},
+                sweep_years, sweep_kms
+            )
+        # Nearest real listings from the KD-tree index, same brand/fuel/transmission where possible
+        with METRICS.stage('comparables'):
+            similar = load_comparables().query(car['name'], car['year'], car['km_driven'], car['fuel'],
+                                               car['transmission'], k=5)
+    return {
+        'details': details,
+        'purchase': purchase,
+        'model_version': model.version,
+        'price': car_price,
+        'from_table': answer is not None,
+        'interval': price_interval,
+        'coverage': model.intervals['coverage'] if price_interval else None,
+        'chart': what_if.grid_chart_data(price_grid, sweep_years, sweep_kms),
+        'similar': similar,
+    }
 
-# Predict button
-st.markdown("---")
-predict_col1, predict_col2, predict_col3 = st.columns([1, 2, 1])
-with predict_col2:
-    predict_button = st.button('🔮 PREDICT CAR PRICE NOW', use_container_width=True)
+def show_prediction(result, celebrate=False):
+    details = result['details']
+    name, year, km_driven = details['name'], details['year'], details['km_driven']
+    fuel, transmission, owner = details['fuel'], details['transmission'], details['owner']
+    location, condition = details['location'], details['condition']
+    car_price = result['price']
 
-if predict_button:
-    with st.spinner('🔄 Analyzing car details and calculating price...'):
-        # Prepare input data
-        input_data_model = pd.DataFrame(
-            [[name, year, km_driven, fuel, seller_type, transmission, owner]],
-            columns=['name', 'year', 'km_driven', 'fuel', 'seller_type', 'transmission', 'owner']
-        )
-        
-        # Data preprocessing
-        input_data_model['owner'].replace(
-            ['owner_First Owner', 'owner_Second Owner', 'owner_Fourth & owner_Above Owner', 'Third Owner', 'Test Drive Car'],
-            [1, 2, 3, 4, 5], inplace=True
-        )
-        input_data_model['fuel'].replace(
-            ['fuel_Petrol', 'fuel_Diesel', 'fuel_CNG', 'fuel_LPG', 'fuel_Electric'],
-            [1, 2, 3, 4, 5], inplace=True
-        )
-        input_data_model['seller_type'].replace(
-            ['seller_Individual', 'seller_Dealer', 'seller_Trustmark Dealer'],
-            [1, 2, 3], inplace=True
-        )
-        input_data_model['transmission'].replace(
-            ['transmission_Manual', 'transmission_Automatic'],
-            [1, 2], inplace=True
-        )
-        input_data_model['name'].replace(
-            ['name_Maruti', 'name_Hyundai', 'name_Datsun', 'name_Honda', 'name_Tata', 'name_Chevrolet',
-             'name_Toyota', 'name_Jaguar', 'name_Mercedes-Benz', 'name_Audi', 'name_Skoda', 'name_Jeep',
-             'name_BMW', 'name_Mahindra', 'name_Ford', 'name_Nissan', 'name_Renault', 'name_Fiat',
-             'name_Volkswagen', 'name_Volvo', 'name_Mitsubishi', 'name_Land', 'name_Daewoo', 'name_MG',
-             'name_Force', 'name_Isuzu', 'name_OpelCorsa', 'name_Ambassador', 'name_Kia'],
-            list(range(1, 30)), inplace=True
-        )
-        
-        # One-hot encoding
-        input_data_model_encoded = pd.get_dummies(input_data_model)
-        for col in columns:
-            if col not in input_data_model_encoded.columns:
-                input_data_model_encoded[col] = 0
-        
-        input_data_model_encoded = input_data_model_encoded[columns]
-        
-        # Predict
-        car_price = model.predict(input_data_model_encoded)[0]
-        
-        # Display results
-        st.markdown("---")
+    # Display results
+    st.markdown("---")
+    if celebrate:
         st.balloons()
-        st.markdown("<h2 style='text-align: center; color: #a78bfa;'>✅ Prediction Complete!</h2>", unsafe_allow_html=True)
-        
-        # Main price display
-        result_col1, result_col2, result_col3 = st.columns([1, 2, 1])
-        with result_col2:
-            st.markdown(f"""
-            <div class="price-card">
-                <h2 style="margin:0; color: #ffffff; font-size: 24px; text-shadow: 2px 2px 4px rgba(0,0,0,0.3);">💎 Predicted Market Value</h2>
-                <h1 style="margin:15px 0; color: #ffffff; font-size: 56px; font-weight: 900; text-shadow: 3px 3px 6px rgba(0,0,0,0.4);">₹ {car_price:,.0f}</h1>
-                <p style="margin:0; color: #ffffff; font-size: 18px; text-shadow: 1px 1px 2px rgba(0,0,0,0.3);">Current Estimated Price</p>
+    st.markdown("<h2 style='text-align: center; color: #a78bfa;'>✅ Prediction Complete!</h2>", unsafe_allow_html=True)
+    
+    # Main price display
+    result_col1, result_col2, result_col3 = st.columns([1, 2, 1])
+    with result_col2:
+        st.markdown(f"""
+        <div class="price-card">
+            <h2 style="margin:0; color: #ffffff; font-size: 24px; text-shadow: 2px 2px 4px rgba(0,0,0,0.3);">💎 Predicted Market Value</h2>
+            <h1 style="margin:15px 0; color: #ffffff; font-size: 56px; font-weight: 900; text-shadow: 3px 3px 6px rgba(0,0,0,0.4);">₹ {car_price:,.0f}</h1>
+            <p style="margin:0; color: #ffffff; font-size: 18px; text-shadow: 1px 1px 2px rgba(0,0,0,0.3);">Current Estimated Price</p>
+        </div>
+        """, unsafe_allow_html=True)
+        cache_stats = prediction_cache.stats()
+        st.caption(f"⚡ Prediction cache: {cache_stats['hits']:,} hits / {cache_stats['misses']:,} misses "
+                   f"({cache_stats['hit_rate']:.0%} hit rate)")
+        if price_table is not None:
+            table_stats = price_table.stats(result['model_version'])
+            if table_stats['stale']:
+                st.caption(f"📋 Price table is stale (built for model {table_stats['model_version']}); "
+                           f"priced by the model")
+            else:
+                st.caption(f"📋 {'Answered from' if result['from_table'] else 'Not in'} the price table · "
+                           f"{table_stats['hits']:,} hits / {table_stats['misses']:,} misses · covers "
+                           f"{table_stats['coverage']['brand']:.0%} of listings by brand")
+        st.caption(f"Priced {year} {name}, {km_driven:,} km · model {result['model_version']}")
+    
+    # Key metrics
+    st.markdown("<div class='section-header'>📊 Key Metrics</div>", unsafe_allow_html=True)
+    metric_col1, metric_col2, metric_col3, metric_col4 = st.columns(4)
+    
+    age = datetime.now().year - year
+    avg_km_per_year = km_driven / age if age > 0 else km_driven
+    price_range_low, price_range_high = result['interval'] or (car_price, car_price)
+    range_label = f"{result['coverage']:.0%} Range" if result['interval'] else "Price Range"
+    
+    with metric_col1:
+        st.markdown(f"""
+        <div class='metric-container'>
+            <div style='text-align: center;'>
+                <p style='color: #94a3b8; margin: 0;'>🕐 Car Age</p>
+                <h2 style='color: #e2e8f0; margin: 10px 0;'>{age} years</h2>
             </div>
-            """, unsafe_allow_html=True)
-        
-        # Key metrics
-        st.markdown("<div class='section-header'>📊 Key Metrics</div>", unsafe_allow_html=True)
-        metric_col1, metric_col2, metric_col3, metric_col4 = st.columns(4)
-        
-        age = datetime.now().year - year
-        avg_km_per_year = km_driven / age if age > 0 else km_driven
-        price_range_low = car_price * 0.9
-        price_range_high = car_price * 1.1
-        
-        with metric_col1:
-            st.markdown(f"""
-            <div class='metric-container'>
-                <div style='text-align: center;'>
-                    <p style='color: #94a3b8; margin: 0;'>🕐 Car Age</p>
-                    <h2 style='color: #e2e8f0; margin: 10px 0;'>{age} years</h2>
-                </div>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    with metric_col2:
+        st.markdown(f"""
+        <div class='metric-container'>
+            <div style='text-align: center;'>
+                <p style='color: #94a3b8; margin: 0;'>📏 Avg KM/Year</p>
+                <h2 style='color: #e2e8f0; margin: 10px 0;'>{avg_km_per_year:,.0f}</h2>
             </div>
-            """, unsafe_allow_html=True)
-        
-        with metric_col2:
-            st.markdown(f"""
-            <div class='metric-container'>
-                <div style='text-align: center;'>
-                    <p style='color: #94a3b8; margin: 0;'>📏 Avg KM/Year</p>
-                    <h2 style='color: #e2e8f0; margin: 10px 0;'>{avg_km_per_year:,.0f}</h2>
-                </div>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    with metric_col3:
+        st.markdown(f"""
+        <div class='metric-container'>
+            <div style='text-align: center;'>
+                <p style='color: #94a3b8; margin: 0;'>📈 {range_label}</p>
+                <h2 style='color: #e2e8f0; margin: 10px 0; font-size: 18px;'>₹{price_range_low/100000:.1f}L-{price_range_high/100000:.1f}L</h2>
             </div>
-            """, unsafe_allow_html=True)
-        
-        with metric_col3:
-            st.markdown(f"""
-            <div class='metric-container'>
-                <div style='text-align: center;'>
-                    <p style='color: #94a3b8; margin: 0;'>📈 Price Range</p>
-                    <h2 style='color: #e2e8f0; margin: 10px 0; font-size: 18px;'>₹{price_range_low/100000:.1f}L-{price_range_high/100000:.1f}L</h2>
-                </div>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    with metric_col4:
+        price_per_km = car_price / km_driven if km_driven > 0 else 0
+        st.markdown(f"""
+        <div class='metric-container'>
+            <div style='text-align: center;'>
+                <p style='color: #94a3b8; margin: 0;'>💹 Price/KM</p>
+                <h2 style='color: #e2e8f0; margin: 10px 0;'>₹{price_per_km:.2f}</h2>
             </div>
-            """, unsafe_allow_html=True)
+        </div>
+        """, unsafe_allow_html=True)
+    
+    st.markdown("<div class='section-header'>📈 Price Curves by Year and KM Driven</div>", unsafe_allow_html=True)
+    st.line_chart(result['chart'], x='year', x_label='Model Year', y_label='Predicted Price (₹)')
+    
+    # Purchase price comparison
+    if result['purchase']:
+        purchase_price, purchase_year, purchase_km = result['purchase']
+        st.markdown("---")
+        st.markdown("<div class='section-header'>💰 Purchase Price Analysis</div>", unsafe_allow_html=True)
         
-        with metric_col4:
-            price_per_km = car_price / km_driven if km_driven > 0 else 0
-            st.markdown(f"""
-            <div class='metric-container'>
-                <div style='text-align: center;'>
-                    <p style='color: #94a3b8; margin: 0;'>💹 Price/KM</p>
-                    <h2 style='color: #e2e8f0; margin: 10px 0;'>₹{price_per_km:.2f}</h2>
+        price_diff = car_price - purchase_price
+        price_diff_percent = (price_diff / purchase_price) * 100
+        years_owned = datetime.now().year - purchase_year
+        annual_change = price_diff / years_owned if years_owned > 0 else 0
+        
+        analysis_col1, analysis_col2 = st.columns(2)
+        
+        with analysis_col1:
+            if price_diff >= 0:
+                st.markdown(f"""
+                <div class='comparison-card'>
+                    <h3 style='margin: 0 0 15px 0;'>📈 Value Appreciation</h3>
+                    <h1 style='margin: 10px 0; font-size: 36px;'>+₹{price_diff:,.0f}</h1>
+                    <p style='margin: 5px 0; font-size: 18px;'>+{price_diff_percent:.1f}% gain</p>
+                    <hr style='border-color: rgba(255,255,255,0.3); margin: 15px 0;'>
+                    <p style='margin: 0;'><strong>Purchase Price:</strong> ₹{purchase_price:,.0f}</p>
+                    <p style='margin: 5px 0;'><strong>Current Value:</strong> ₹{car_price:,.0f}</p>
+                    <p style='margin: 5px 0;'><strong>Annual Change:</strong> ₹{annual_change:,.0f}/year</p>
                 </div>
-            </div>
-            """, unsafe_allow_html=True)
+                """, unsafe_allow_html=True)
+            else:
+                st.markdown(f"""
+                <div class='depreciation-card'>
+                    <h3 style='margin: 0 0 15px 0;'>📉 Value Depreciation</h3>
+                    <h1 style='margin: 10px 0; font-size: 36px;'>-₹{abs(price_diff):,.0f}</h1>
+                    <p style='margin: 5px 0; font-size: 18px;'>{price_diff_percent:.1f}% loss</p>
+                    <hr style='border-color: rgba(255,255,255,0.3); margin: 15px 0;'>
+                    <p style='margin: 0;'><strong>Purchase Price:</strong> ₹{purchase_price:,.0f}</p>
+                    <p style='margin: 5px 0;'><strong>Current Value:</strong> ₹{car_price:,.0f}</p>
+                    <p style='margin: 5px 0;'><strong>Annual Loss:</strong> ₹{abs(annual_change):,.0f}/year</p>
+                </div>
+                """, unsafe_allow_html=True)
         
-        # Purchase price comparison
-        if compare_price and purchase_price and purchase_year:
-            st.markdown("---")
-            st.markdown("<div class='section-header'>💰 Purchase Price Analysis</div>", unsafe_allow_html=True)
-            
-            price_diff = car_price - purchase_price
-            price_diff_percent = (price_diff / purchase_price) * 100
-            years_owned = datetime.now().year - purchase_year
-            annual_change = price_diff / years_owned if years_owned > 0 else 0
+        with analysis_col2:
+            # Detailed breakdown
+            km_increase = km_driven - purchase_km
+            depreciation_rate = (abs(annual_change) / purchase_price * 100) if purchase_price > 0 else 0
             
-            analysis_col1, analysis_col2 = st.columns(2)
-            
-            with analysis_col1:
-                if price_diff >= 0:
-                    st.markdown(f"""
-                    <div class='comparison-card'>
-                        <h3 style='margin: 0 0 15px 0;'>📈 Value Appreciation</h3>
-                        <h1 style='margin: 10px 0; font-size: 36px;'>+₹{price_diff:,.0f}</h1>
-                        <p style='margin: 5px 0; font-size: 18px;'>+{price_diff_percent:.1f}% gain</p>
-                        <hr style='border-color: rgba(255,255,255,0.3); margin: 15px 0;'>
-                        <p style='margin: 0;'><strong>Purchase Price:</strong> ₹{purchase_price:,.0f}</p>
-                        <p style='margin: 5px 0;'><strong>Current Value:</strong> ₹{car_price:,.0f}</p>
-                        <p style='margin: 5px 0;'><strong>Annual Change:</strong> ₹{annual_change:,.0f}/year</p>
+            st.markdown(f"""
+            <div class='info-card'>
+                <h3 style='color: #a78bfa; margin-top: 0;'>📊 Ownership Analysis</h3>
+                <div style='margin: 15px 0;'>
+                    <div style='display: flex; justify-content: space-between; padding: 10px 0; border-bottom: 1px solid #475569;'>
+                        <span style='color: #94a3b8;'>Years Owned:</span>
+                        <span style='color: #e2e8f0; font-weight: 600;'>{years_owned} years</span>
                     </div>
-                    """, unsafe_allow_html=True)
-                else:
-                    st.markdown(f"""
-                    <div class='depreciation-card'>
-                        <h3 style='margin: 0 0 15px 0;'>📉 Value Depreciation</h3>
-                        <h1 style='margin: 10px 0; font-size: 36px;'>-₹{abs(price_diff):,.0f}</h1>
-                        <p style='margin: 5px 0; font-size: 18px;'>{price_diff_percent:.1f}% loss</p>
-                        <hr style='border-color: rgba(255,255,255,0.3); margin: 15px 0;'>
-                        <p style='margin: 0;'><strong>Purchase Price:</strong> ₹{purchase_price:,.0f}</p>
-                        <p style='margin: 5px 0;'><strong>Current Value:</strong> ₹{car_price:,.0f}</p>
-                        <p style='margin: 5px 0;'><strong>Annual Loss:</strong> ₹{abs(annual_change):,.0f}/year</p>
+                    <div style='display: flex; justify-content: space-between; padding: 10px 0; border-bottom: 1px solid #475569;'>
+                        <span style='color: #94a3b8;'>KM Driven:</span>
+                        <span style='color: #e2e8f0; font-weight: 600;'>{km_increase:,} km</span>
                     </div>
-                    """, unsafe_allow_html=True)
-            
-            with analysis_col2:
-                # Detailed breakdown
-                km_increase = km_driven - purchase_km if compare_price else 0
-                depreciation_rate = (abs(annual_change) / purchase_price * 100) if purchase_price > 0 else 0
-                
-                st.markdown(f"""
-                <div class='info-card'>
-                    <h3 style='color: #a78bfa; margin-top: 0;'>📊 Ownership Analysis</h3>
-                    <div style='margin: 15px 0;'>
-                        <div style='display: flex; justify-content: space-between; padding: 10px 0; border-bottom: 1px solid #475569;'>
-                            <span style='color: #94a3b8;'>Years Owned:</span>
-                            <span style='color: #e2e8f0; font-weight: 600;'>{years_owned} years</span>
-                        </div>
-                        <div style='display: flex; justify-content: space-between; padding: 10px 0; border-bottom: 1px solid #475569;'>
-                            <span style='color: #94a3b8;'>KM Driven:</span>
-                            <span style='color: #e2e8f0; font-weight: 600;'>{km_increase:,} km</span>
-                        </div>
-                        <div style='display: flex; justify-content: space-between; padding: 10px 0; border-bottom: 1px solid #475569;'>
-                            <span style='color: #94a3b8;'>Avg KM/Year:</span>
-                            <span style='color: #e2e8f0; font-weight: 600;'>{km_increase/years_owned if years_owned > 0 else 0:,.0f} km</span>
-                        </div>
-                        <div style='display: flex; justify-content: space-between; padding: 10px 0;'>
-                            <span style='color: #94a3b8;'>Annual Rate:</span>
-                            <span style='color: #e2e8f0; font-weight: 600;'>{depreciation_rate:.1f}%/year</span>
-                        </div>
+                    <div style='display: flex; justify-content: space-between; padding: 10px 0; border-bottom: 1px solid #475569;'>
+                        <span style='color: #94a3b8;'>Avg KM/Year:</span>
+                        <span style='color: #e2e8f0; font-weight: 600;'>{km_increase/years_owned if years_owned > 0 else 0:,.0f} km</span>
                     </div>
-                    <div style='background: rgba(102, 126, 234, 0.2); padding: 15px; border-radius: 8px; margin-top: 15px;'>
-                        <p style='margin: 0; color: #cbd5e1; font-size: 14px;'>
-                            {'✅ Your car is maintaining value well!' if price_diff >= 0 or depreciation_rate < 10 else '💡 Consider maintenance to preserve value'}
-                        </p>
+                    <div style='display: flex; justify-content: space-between; padding: 10px 0;'>
+                        <span style='color: #94a3b8;'>Annual Rate:</span>
+                        <span style='color: #e2e8f0; font-weight: 600;'>{depreciation_rate:.1f}%/year</span>
                     </div>
                 </div>
-                """, unsafe_allow_html=True)
-        
-        # Recommendations
-        st.markdown("---")
-        st.markdown("<div class='section-header'>💡 Expert Recommendations</div>", unsafe_allow_html=True)
-        
-        rec_col1, rec_col2 = st.columns(2)
-        
-        with rec_col1:
-            st.markdown("""
-            <div class='recommendation-box'>
-                <h3 style='color: #10b981; margin-top: 0;'>✅ Strong Selling Points</h3>
-            """, unsafe_allow_html=True)
-            
-            points = []
-            if km_driven < 50000:
-                points.append("• Low mileage is highly attractive to buyers")
-            if 'First' in owner:
-                points.append("• First owner status adds premium value")
-            if year >= datetime.now().year - 5:
-                points.append("• Recent model year commands better price")
-            if condition in ['Excellent', 'Good']:
-                points.append("• Excellent condition justifies premium pricing")
-            if 'Automatic' in transmission:
-                points.append("• Automatic transmission has higher demand")
-            if not points:
-                points.append("• Well-maintained vehicle with complete service history")
-            
-            for point in points:
-                st.markdown(f"<p style='color: #cbd5e1; margin: 5px 0;'>{point}</p>", unsafe_allow_html=True)
-            st.markdown("</div>", unsafe_allow_html=True)
-        
-        with rec_col2:
-            st.markdown("""
-            <div class='recommendation-box'>
-                <h3 style='color: #f59e0b; margin-top: 0;'>⚠️ Factors Affecting Price</h3>
+                <div style='background: rgba(102, 126, 234, 0.2); padding: 15px; border-radius: 8px; margin-top: 15px;'>
+                    <p style='margin: 0; color: #cbd5e1; font-size: 14px;'>
+                        {'✅ Your car is maintaining value well!' if price_diff >= 0 or depreciation_rate < 10 else '💡 Consider maintenance to preserve value'}
+                    </p>
+                </div>
+            </div>
             """, unsafe_allow_html=True)
-            
-            factors = []
-            if km_driven > 100000:
-                factors.append("• High mileage may reduce asking price")
-            if year < datetime.now().year - 10:
-                factors.append("• Older models face faster depreciation")
-            if 'Manual' in transmission and fuel != 'Diesel':
-                factors.append("• Manual transmission has lower demand")
-            if condition in ['Fair', 'Poor']:
-                factors.append("• Condition needs improvement for better value")
-            factors.append(f"• Location: {location} market conditions apply")
-            
-            for factor in factors:
-                st.markdown(f"<p style='color: #cbd5e1; margin: 5px 0;'>{factor}</p>", unsafe_allow_html=True)
-            st.markdown("</div>", unsafe_allow_html=True)
-        
-        # Market insights
-        st.markdown("---")
-        st.markdown("<div class='section-header'>🎯 Market Insights</div>", unsafe_allow_html=True)
+    
+    # Recommendations
+    st.markdown("---")
+    st.markdown("<div class='section-header'>💡 Expert Recommendations</div>", unsafe_allow_html=True)
+    
+    rec_col1, rec_col2 = st.columns(2)
+    
+    with rec_col1:
+        st.markdown("""
+        <div class='recommendation-box'>
+            <h3 style='color: #10b981; margin-top: 0;'>✅ Strong Selling Points</h3>
+        """, unsafe_allow_html=True)
         
-        insight_col1, insight_col2, insight_col3 = st.columns(3)
+        points = []
+        if km_driven < 50000:
+            points.append("• Low mileage is highly attractive to buyers")
+        if 'First' in owner:
+            points.append("• First owner status adds premium value")
+        if year >= datetime.now().year - 5:
+            points.append("• Recent model year commands better price")
+        if condition in ['Excellent', 'Good']:
+            points.append("• Excellent condition justifies premium pricing")
+        if 'Automatic' in transmission:
+            points.append("• Automatic transmission has higher demand")
+        if not points:
+            points.append("• Well-maintained vehicle with complete service history")
         
-        with insight_col1:
-            st.markdown("""
-            <div class='info-card'>
-                <h4 style='color: #a78bfa; margin-top: 0;'>🏆 Best Time to Sell</h4>
-                <p style='color: #cbd5e1;'>Festive seasons (Diwali, New Year) typically see 15-20% higher demand and better prices.</p>
-            </div>
-            """, unsafe_allow_html=True)
+        for point in points:
+            st.markdown(f"<p style='color: #cbd5e1; margin: 5px 0;'>{point}</p>", unsafe_allow_html=True)
+        st.markdown("</div>", unsafe_allow_html=True)
+    
+    with rec_col2:
+        st.markdown("""
+        <div class='recommendation-box'>
+            <h3 style='color: #f59e0b; margin-top: 0;'>⚠️ Factors Affecting Price</h3>
+        """, unsafe_allow_html=True)
         
-        with insight_col2:
-            st.markdown("""
-            <div class='info-card'>
-                <h4 style='color: #a78bfa; margin-top: 0;'>📸 Presentation Tips</h4>
-                <p style='color: #cbd5e1;'>Professional photos, complete service records, and detailed listings can increase sale price by 10-15%.</p>
-            </div>
-            """, unsafe_allow_html=True)
+        factors = []
+        if km_driven > 100000:
+            factors.append("• High mileage may reduce asking price")
+        if year < datetime.now().year - 10:
+            factors.append("• Older models face faster depreciation")
+        if 'Manual' in transmission and fuel != 'Diesel':
+            factors.append("• Manual transmission has lower demand")
+        if condition in ['Fair', 'Poor']:
+            factors.append("• Condition needs improvement for better value")
+        factors.append(f"• Location: {location} market conditions apply")
         
-        with insight_col3:
-            st.markdown(f"""
-            <div class='info-card'>
-                <h4 style='color: #a78bfa; margin-top: 0;'>💼 Negotiation Range</h4>
-                <p style='color: #cbd5e1;'>Expect buyers to negotiate. Keep a buffer of ₹{car_price * 0.05:,.0f} - ₹{car_price * 0.1:,.0f} (5-10%).</p>
-            </div>
-            """, unsafe_allow_html=True)
+        for factor in factors:
+            st.markdown(f"<p style='color: #cbd5e1; margin: 5px 0;'>{factor}</p>", unsafe_allow_html=True)
+        st.markdown("</div>", unsafe_allow_html=True)
+    
+    # Market insights
+    st.markdown("---")
+    st.markdown("<div class='section-header'>🎯 Market Insights</div>", unsafe_allow_html=True)
+    
+    insight_col1, insight_col2, insight_col3 = st.columns(3)
+    
+    with insight_col1:
+        st.markdown("""
+        <div class='info-card'>
+            <h4 style='color: #a78bfa; margin-top: 0;'>🏆 Best Time to Sell</h4>
+            <p style='color: #cbd5e1;'>Festive seasons (Diwali, New Year) typically see 15-20% higher demand and better prices.</p>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    with insight_col2:
+        st.markdown("""
+        <div class='info-card'>
+            <h4 style='color: #a78bfa; margin-top: 0;'>📸 Presentation Tips</h4>
+            <p style='color: #cbd5e1;'>Professional photos, complete service records, and detailed listings can increase sale price by 10-15%.</p>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    with insight_col3:
+        st.markdown(f"""
+        <div class='info-card'>
+            <h4 style='color: #a78bfa; margin-top: 0;'>💼 Negotiation Range</h4>
+            <p style='color: #cbd5e1;'>Expect buyers to negotiate. Keep a buffer of ₹{car_price * 0.05:,.0f} - ₹{car_price * 0.1:,.0f} (5-10%).</p>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    similar = result['similar']
+    if similar:
+        st.markdown("#### 🔍 Comparable Listings")
+        st.dataframe({
+            'Car': [c['name'] for c in similar],
+            'Year': [c['year'] for c in similar],
+            'KM Driven': [f"{c['km_driven']:,}" for c in similar],
+            'Fuel': [c['fuel'] for c in similar],
+            'Transmission': [c['transmission'] for c in similar],
+            'Owner': [c['owner'] for c in similar],
+            'Sold For': [f"₹{c['selling_price']:,.0f}" for c in similar],
+        }, hide_index=True, width='stretch')
+        median_price = sorted(c['selling_price'] for c in similar)[len(similar) // 2]
+        st.caption(f"Median of {len(similar)} comparable sales: ₹{median_price:,.0f} "
+                   f"(model estimate ₹{car_price:,.0f})")
+
+@st.fragment
+def prediction():
+    # Predict button
+    st.markdown("---")
+    predict_col1, predict_col2, predict_col3 = st.columns([1, 2, 1])
+    with predict_col2:
+        predict_button = st.button('🔮 PREDICT CAR PRICE NOW', width='stretch')
+    
+    if not predict_button:
+        # Redraw the last results, if any, without recomputing them
+        if 'prediction' in st.session_state:
+            show_prediction(st.session_state['prediction'])
+        return
+
+    # ?profile=1 on the page URL profiles this prediction (CPU and allocations)
+    profiler = RequestProfiler(st.query_params.get('profile') == '1').start()
+    # A fragment rerun skips the top of the script, so fetch the model here:
+    # the registry may have swapped in a new one since the last full run
+    model = registry.current()
+    METRICS.inc('predictions_total', model_version=model.version)
+    details = {field: st.session_state[field] for field in DETAIL_FIELDS}
+    purchase = None
+    if st.session_state.get('compare_price') and st.session_state.get('purchase_price') \
+            and st.session_state.get('purchase_year'):
+        purchase = tuple(st.session_state[key] for key in ('purchase_price', 'purchase_year', 'purchase_km'))
+    result = st.session_state['prediction'] = predict_car(model, details, purchase)
+
+    render_started = time.perf_counter()
+    show_prediction(result, celebrate=True)
+    # 'render' covers everything after the model calls: the cards, chart and comparables
+    METRICS.observe('stage_seconds', time.perf_counter() - render_started, stage='render')
+    profile = profiler.stop()
+    cache_stats = prediction_cache.stats()
+    for key in ('hits', 'misses', 'evictions', 'invalidations', 'size'):
+        METRICS.set_gauge(f'prediction_cache_{key}', cache_stats[key])
+    if price_table is not None:
+        table_stats = price_table.stats(model.version)
+        for key in ('hits', 'misses', 'stale_lookups'):
+            METRICS.set_gauge(f'price_table_{key}', table_stats[key])
+        METRICS.set_gauge('price_table_stale', int(table_stats['stale']))
+    # Prometheus text for a node-exporter textfile collector; set CAR_PRICE_METRICS_PATH= to disable
+    metrics_path = os.environ.get('CAR_PRICE_METRICS_PATH', METRICS_PATH)
+    if metrics_path:
+        METRICS.dump(metrics_path)
+    
+    if profile:
+        logger.info("Profiled prediction (peak %.2f MiB traced):\n%s", profile['peak_bytes'] / 2 ** 20, profile['cpu'])
+        with st.expander("🔬 Request Profile"):
+            st.caption(f"Peak traced memory: {profile['peak_bytes'] / 2 ** 20:.2f} MiB")
+            st.code(profile['cpu'])
+            st.code('\n'.join(profile['allocations']))
+
+# Main content
+car_details()
+purchase_details()
+prediction()
 
 # Footer
 st.markdown("---")
@@ -658,4 +851,4 @@ st.markdown("""
             Actual prices may vary based on specific vehicle condition, location demand, and negotiation.
         </p>
     </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
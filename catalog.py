@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass, field
+
+CATALOG_FIELDS = ['fuel', 'seller_type', 'transmission', 'owner']
+CATALOG_PATH = 'catalog.json'
+CSV_PATH = 'cardetails.csv.csv'
+
+
+@dataclass(frozen=True)
+class Catalog:
+    """Everything the input widgets need, computed once from the listings."""
+
+    brands: list
+    categories: dict = field(default_factory=dict)
+    year_min: int = 0
+    year_max: int = 0
+    n_rows: int = 0
+
+    @property
+    def n_brands(self):
+        return len(self.brands)
+
+
+def build_catalog(listings, brand_column='brand'):
+    # One vectorized unique() per column; category order follows first
+    # appearance in the data, which is what the dropdowns have always shown
+    years = listings['year']
+    return Catalog(
+        brands=sorted(str(b) for b in listings[brand_column].unique()),
+        categories={col: [str(v) for v in listings[col].unique()] for col in CATALOG_FIELDS},
+        year_min=int(years.min()),
+        year_max=int(years.max()),
+        n_rows=len(listings),
+    )
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_catalog(catalog, path=CATALOG_PATH, csv_path=CSV_PATH):
+    payload = asdict(catalog)
+    payload['source_sha256'] = _sha256(csv_path)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+def load_catalog(path=CATALOG_PATH, csv_path=CSV_PATH):
+    """Read the JSON sidecar, or return None if it is missing or stale.
+
+    Staleness is decided by mtime first and only falls back to hashing the
+    CSV when the CSV looks newer (e.g. after a fresh checkout).
+    """
+    try:
+        with open(path) as f:
+            payload = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if os.path.getmtime(csv_path) > os.path.getmtime(path):
+        if payload.get('source_sha256') != _sha256(csv_path):
+            return None
+        os.utime(path)
+    payload.pop('source_sha256', None)
+    return Catalog(**payload)
+
+
+def load_or_build_catalog(path=CATALOG_PATH, csv_path=CSV_PATH):
+    catalog = load_catalog(path, csv_path)
+    if catalog is None:
+        # Only a missing or stale sidecar pays for pyarrow/pandas and the listings
+        from ingest import load_listings, LISTINGS_PATH
+        listings = load_listings(['brand', 'year'] + CATALOG_FIELDS, LISTINGS_PATH, csv_path)
+        catalog = build_catalog(listings)
+        save_catalog(catalog, path, csv_path)
+    return catalog
+
+
+if __name__ == '__main__':
+    catalog = load_or_build_catalog()
+    print(f" Catalog of {catalog.n_rows:,} listings / {catalog.n_brands} brands saved to {CATALOG_PATH}")
@@ -0,0 +1,231 @@
+import argparse
+import json
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+DEDUP_COLUMNS = ['name', 'year', 'selling_price', 'km_driven', 'fuel', 'seller_type', 'transmission', 'owner']
+YEAR_MIN = 1980
+PRICE_MIN = 10000
+KM_MAX = 1000000
+# No private car averages this many km per year of age
+MAX_KM_PER_YEAR = 100000
+# Modified z-score (0.6745 * deviation / MAD) of log price within a brand
+OUTLIER_Z = 3.5
+# Brands with fewer rows than this are checked against the global distribution
+MIN_BRAND_ROWS = 10
+
+
+def brands_of(names):
+    # Split each distinct name once and broadcast back through the codes;
+    # listings repeat a few thousand names across millions of rows
+    codes, uniques = pd.factorize(names)
+    brands = pd.Index(uniques).astype(str).str.split(' ', n=1).str[0].str.strip()
+    return np.asarray(brands, dtype=object)[codes]
+
+
+def brand_price_stats(values, groups, min_rows=MIN_BRAND_ROWS):
+    """Per-group median and MAD of `values`, plus the global pair small groups fall back to."""
+    frame = pd.DataFrame({'value': values, 'group': groups})
+    grouped = frame.groupby('group', observed=True)['value']
+    median = grouped.median()
+    mad = (frame['value'] - grouped.transform('median')).abs().groupby(frame['group'], observed=True).median()
+    stats = pd.DataFrame({'median': median, 'mad': mad})[grouped.size() >= min_rows]
+    global_median = float(np.median(values))
+    return stats, (global_median, float(np.median(np.abs(values - global_median))))
+
+
+def _robust_z(values, groups, stats):
+    # Groups without stats of their own (small or unseen brands) use the global median and MAD
+    by_group, (global_median, global_mad) = stats
+    lookup = by_group.reindex(pd.Index(groups, dtype=object))
+    median = lookup['median'].fillna(global_median).to_numpy(dtype=float)
+    mad = lookup['mad'].fillna(global_mad).to_numpy(dtype=float)
+
+    z = np.zeros(len(values))
+    valid = mad > 0
+    z[valid] = 0.6745 * (values[valid] - median[valid]) / mad[valid]
+    return z
+
+
+class SeenHashes:
+    """Set of uint64 row hashes kept as sorted, disjoint runs merged geometrically.
+
+    A new chunk sorts only itself; runs are merged while the newest is at
+    least half the size of the one before it, so there are at most log2(N)
+    runs, each hash is re-merged O(log N) times in all, and a membership
+    test is one binary search per run rather than a pass over every hash.
+    """
+
+    def __init__(self, hashes=None):
+        self._runs = []
+        if hashes is not None:
+            self.add(hashes)
+
+    def __len__(self):
+        return sum(len(run) for run in self._runs)
+
+    def copy(self):
+        # Runs are never modified in place, so copies can share them
+        other = SeenHashes()
+        other._runs = list(self._runs)
+        return other
+
+    def contains(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        found = np.zeros(len(hashes), dtype=bool)
+        for run in self._runs:
+            position = np.minimum(np.searchsorted(run, hashes), len(run) - 1)
+            found |= run[position] == hashes
+        return found
+
+    def add(self, hashes):
+        run = np.unique(np.asarray(hashes, dtype=np.uint64))
+        run = run[~self.contains(run)]
+        if not len(run):
+            return
+        self._runs.append(run)
+        while len(self._runs) > 1 and 2 * len(self._runs[-1]) >= len(self._runs[-2]):
+            newer, older = self._runs.pop(), self._runs.pop()
+            merged = np.concatenate([older, newer])
+            merged.sort(kind='stable')
+            self._runs.append(merged)
+
+    def to_array(self):
+        merged = np.concatenate(self._runs) if self._runs else np.empty(0, dtype=np.uint64)
+        merged.sort()
+        return merged
+
+
+class ListingCleaner:
+    """Vectorised validation, de-duplication and outlier filtering for listings.
+
+    Every rule is a boolean mask computed over whole columns; a row is kept
+    only if it passes all of them. Duplicates are found by hashing each
+    row's fields to one uint64, and the hashes seen so far are kept (in a
+    `SeenHashes`), so chunks fed through the same cleaner are de-duplicated
+    against each other too; `seen` carries hashes over from earlier runs.
+    That costs 8 bytes per kept row, so a cleaned stream's memory grows
+    with the file, though far more slowly than the rows themselves.
+    `report` accumulates how many rows each rule removed.
+
+    Outliers are judged against each brand's median and MAD of log price.
+    By default those come from the frame being cleaned; call `fit` first to
+    take them from the whole input instead, so chunks are judged exactly as
+    the concatenated frame would be.
+    """
+
+    def __init__(self, reference_year=None, outlier_z=OUTLIER_Z, min_brand_rows=MIN_BRAND_ROWS, seen=None):
+        self.reference_year = reference_year or datetime.now().year
+        self.outlier_z = outlier_z
+        self.min_brand_rows = min_brand_rows
+        self._seen = SeenHashes(seen)
+        self.price_stats = None
+        self.report = {'rows_in': 0, 'rows_out': 0, 'removed': {}, 'outliers_by_brand': {},
+                       'reference_year': self.reference_year}
+
+    @property
+    def seen_hashes(self):
+        return self._seen.to_array()
+
+    def _count(self, rule, mask):
+        self.report['removed'][rule] = self.report['removed'].get(rule, 0) + int(mask.sum())
+
+    def _screen(self, frame, seen):
+        # Validation and duplicate masks; adds this frame's valid rows to `seen`
+        year = frame['year'].to_numpy(dtype=float)
+        km = frame['km_driven'].to_numpy(dtype=float)
+        price = frame['selling_price'].to_numpy(dtype=float)
+
+        missing = frame[[c for c in DEDUP_COLUMNS if c in frame]].isna().any(axis=1).to_numpy()
+        out_of_range = ~missing & ((year < YEAR_MIN) | (year > self.reference_year) | (km < 0) | (km > KM_MAX)
+                                   | (price < PRICE_MIN))
+        age = np.maximum(self.reference_year - year, 1)
+        inconsistent = ~missing & ~out_of_range & (km / age > MAX_KM_PER_YEAR)
+        invalid = missing | out_of_range | inconsistent
+
+        hashes = pd.util.hash_pandas_object(frame[[c for c in DEDUP_COLUMNS if c in frame]], index=False).to_numpy()
+        repeated = pd.Series(hashes).duplicated().to_numpy(copy=True)
+        repeated |= seen.contains(hashes)
+        duplicate = ~invalid & repeated
+        seen.add(hashes[~invalid])
+        return missing, out_of_range, inconsistent, duplicate
+
+    def fit(self, frames):
+        """First pass over streamed chunks: brand price statistics of every row `clean` will keep.
+
+        Needs one log price per surviving row, the same order of memory as
+        the duplicate hashes, and leaves `seen` and the report untouched.
+        """
+        seen = self._seen.copy()
+        log_prices, brands = [], []
+        for frame in frames:
+            missing, out_of_range, inconsistent, duplicate = self._screen(frame, seen)
+            candidate = ~(missing | out_of_range | inconsistent | duplicate)
+            log_prices.append(np.log(frame['selling_price'].to_numpy(dtype=float)[candidate]))
+            brands.append(brands_of(frame['name'])[candidate])
+        values = np.concatenate(log_prices) if log_prices else np.empty(0)
+        if len(values):
+            self.price_stats = brand_price_stats(values, np.concatenate(brands), self.min_brand_rows)
+        return self
+
+    def clean(self, frame):
+        self.report['rows_in'] += len(frame)
+        price = frame['selling_price'].to_numpy(dtype=float)
+        missing, out_of_range, inconsistent, duplicate = self._screen(frame, self._seen)
+
+        candidate = ~(missing | out_of_range | inconsistent | duplicate)
+        brands = brands_of(frame['name'])
+        outlier = np.zeros(len(frame), dtype=bool)
+        if candidate.any():
+            values = np.log(price[candidate])
+            stats = self.price_stats
+            if stats is None:
+                stats = brand_price_stats(values, brands[candidate], self.min_brand_rows)
+            z = _robust_z(values, brands[candidate], stats)
+            outlier[np.flatnonzero(candidate)[np.abs(z) > self.outlier_z]] = True
+
+        for rule, mask in (('missing', missing), ('out_of_range', out_of_range), ('inconsistent', inconsistent),
+                           ('duplicate', duplicate), ('price_outlier', outlier)):
+            self._count(rule, mask)
+        by_brand = self.report['outliers_by_brand']
+        for brand, n in zip(*np.unique(brands[outlier].astype(str), return_counts=True)):
+            by_brand[str(brand)] = by_brand.get(str(brand), 0) + int(n)
+
+        keep = candidate & ~outlier
+        self.report['rows_out'] += int(keep.sum())
+        return frame[keep].reset_index(drop=True)
+
+
+def clean_listings(frame, **options):
+    cleaner = ListingCleaner(**options)
+    return cleaner.clean(frame), cleaner.report
+
+
+def format_report(report):
+    removed = ', '.join(f"{n:,} {rule.replace('_', ' ')}" for rule, n in report['removed'].items() if n)
+    return f" Cleaned {report['rows_in']:,} -> {report['rows_out']:,} listings ({removed or 'nothing removed'})"
+
+
+def main(argv=None):
+    from ingest import read_listings
+
+    parser = argparse.ArgumentParser(description="Validate, de-duplicate and outlier-filter a listings file.")
+    parser.add_argument('input', nargs='?', default='cardetails.csv.csv')
+    parser.add_argument('--output', help="Where to write the cleaned listings (CSV or Parquet)")
+    parser.add_argument('--report', help="Where to write the cleaning report as JSON")
+    args = parser.parse_args(argv)
+
+    clean, report = clean_listings(read_listings(args.input))
+    print(format_report(report))
+    if args.output:
+        from ingest import write_listings
+        write_listings(clean, args.output)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import numpy as np
+
+LISTING_COLUMNS = ['name', 'brand', 'year', 'km_driven', 'fuel', 'seller_type', 'transmission', 'owner',
+                   'selling_price']
+# Distance units: one model year counts the same as this many kilometres
+KM_PER_YEAR = 15000.0
+
+
+class ComparablesIndex:
+    """Nearest real listings to a car, from KD-trees over (year, km_driven).
+
+    Listings are partitioned by brand x fuel x transmission, with a
+    per-brand partition as the fallback when the exact segment has too few
+    cars, so a query only searches cars that are actually comparable.
+    """
+
+    def __init__(self, listings, km_per_year=KM_PER_YEAR):
+        # scipy.spatial costs about half a second to import, so the app only
+        # pays for it when the index is first built, not at every cold start
+        from scipy.spatial import cKDTree
+
+        self.km_per_year = km_per_year
+        self.records = {col: listings[col].to_numpy() for col in LISTING_COLUMNS if col in listings}
+        self.records['name'] = listings['name'].astype(str).to_numpy()
+        points = np.column_stack([
+            listings['year'].to_numpy(dtype=float),
+            listings['km_driven'].to_numpy(dtype=float) / km_per_year,
+        ])
+
+        self.partitions = {}
+        segments = listings.groupby(['brand', 'fuel', 'transmission'], observed=True).indices
+        brands = listings.groupby('brand', observed=True).indices
+        for key, rows in list(segments.items()) + [((b,), rows) for b, rows in brands.items()]:
+            key = tuple(str(k) for k in key)
+            self.partitions[key] = (cKDTree(points[rows]), np.asarray(rows))
+
+    def __len__(self):
+        return len(self.records['name'])
+
+    def query(self, brand, year, km_driven, fuel, transmission, k=5):
+        """Up to `k` listings nearest to the car, closest first.
+
+        Each result is a dict of the listing's fields plus `distance` in
+        model-year units.
+        """
+        partition = None
+        for key in ((brand, fuel, transmission), (brand,)):
+            candidate = self.partitions.get(tuple(str(v) for v in key))
+            if candidate is not None:
+                partition = candidate
+                if len(candidate[1]) >= k:
+                    break
+        if partition is None:
+            return []
+
+        tree, rows = partition
+        n = min(k, len(rows))
+        distances, positions = tree.query([float(year), float(km_driven) / self.km_per_year], k=n)
+        distances = np.atleast_1d(distances)
+        positions = np.atleast_1d(positions)
+
+        results = []
+        for distance, i in zip(distances, rows[positions]):
+            result = {col: values[i].item() if hasattr(values[i], 'item') else values[i]
+                      for col, values in self.records.items()}
+            result['distance'] = float(distance)
+            results.append(result)
+        return results
+
+
+def load_comparables():
+    # ingest pulls in pandas/pyarrow, so it is only imported when the index is
+    # built. Cleaned as for training, so a re-posted listing is one comparable
+    # sale rather than several and outlier prices don't skew the median
+    import ingest
+    from cleaning import ListingCleaner
+    return ComparablesIndex(ListingCleaner().clean(ingest.load_listings(LISTING_COLUMNS)))
@@ -0,0 +1,227 @@
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+NUMERIC_FEATURES = ['year', 'km_driven']
+CATEGORICAL_FEATURES = ['name', 'fuel', 'seller_type', 'transmission', 'owner']
+INPUT_FIELDS = ['name', 'year', 'km_driven', 'fuel', 'seller_type', 'transmission', 'owner']
+# How the `name` field maps onto columns: the full listing name, its brand, or
+# its brand / model / variant tokens hashed into a fixed number of buckets
+NAME_ENCODINGS = ['full', 'brand', 'hashed']
+HASH_BUCKETS = 1024
+HASH_PREFIX = 'name_hash_'
+
+
+def brand_of(name):
+    return str(name).split(' ')[0].strip()
+
+
+def name_tokens(name):
+    # 'Maruti Swift Dzire VDI' -> ['Maruti', 'Maruti Swift', 'Maruti Swift Dzire VDI'];
+    # a bare brand is a single token, the same one its listings share.
+    # A missing or blank name has no tokens, rather than hashing 'nan' or ''
+    if name is None or name != name:
+        return []
+    words = str(name).split()
+    if not words:
+        return []
+    return list(dict.fromkeys(' '.join(words[:n]) for n in (1, 2, len(words))))
+
+
+def with_name_prefixes(frame):
+    """Training rows plus copies named by their brand and brand + model alone.
+
+    Every full name carries its brand token and one brand + model token, so
+    without these copies the brand column is always the sum of its model
+    columns and the brand coefficient is unidentified; the app's brand-only query would then
+    score an arbitrary split of that null space. The copies make the brand
+    and brand + model tokens stand for the average car they name.
+    """
+    import pandas as pd
+
+    words = frame['name'].astype(str).str.split()
+    copies = [frame]
+    for n in (1, 2):
+        longer = (words.str.len() > n).to_numpy()
+        copies.append(frame[longer].assign(name=words[longer].str[:n].str.join(' ').to_numpy()))
+    return pd.concat(copies, ignore_index=True)
+
+
+@lru_cache(maxsize=65536)
+def name_buckets(name, buckets=HASH_BUCKETS):
+    # crc32 rather than hash(), which is salted per process and would give
+    # training and serving different buckets
+    return tuple(zlib.crc32(token.encode('utf-8')) % buckets for token in name_tokens(name))
+
+
+def hash_columns(buckets=HASH_BUCKETS):
+    return [f'{HASH_PREFIX}{i}' for i in range(buckets)]
+
+
+def name_keys(values, name_encoding='full'):
+    # Turn raw `name` values into the keys the name columns were built from
+    if name_encoding == 'full':
+        return values
+    if name_encoding == 'brand':
+        if hasattr(values, 'map'):
+            return values.map(brand_of)
+        return [brand_of(v) for v in values]
+    raise ValueError(f"unknown name encoding {name_encoding!r}")
+
+
+def build_columns(frame, drop_first=True, name_encoding='full', hash_buckets=HASH_BUCKETS):
+    # Same layout pd.get_dummies(frame, drop_first=True) produces, without
+    # materialising the dense dummy frame
+    columns = list(NUMERIC_FEATURES)
+    for field in CATEGORICAL_FEATURES:
+        if field == 'name' and name_encoding == 'hashed':
+            columns.extend(hash_columns(hash_buckets))
+            continue
+        values = frame[field].dropna()
+        if field == 'name':
+            values = name_keys(values, name_encoding)
+        categories = sorted(set(values.unique()))
+        if drop_first:
+            categories = categories[1:]
+        columns.extend(f'{field}_{value}' for value in categories)
+    return columns
+
+
+class FeatureEncoder:
+    """Encodes car details into the trained model's column layout.
+
+    The lookup tables are built once, so encoding a car only touches the
+    handful of input fields instead of every trained column. With the
+    'hashed' name encoding each name adds one count per brand / model /
+    variant token to its hash bucket column, so unseen variants still land
+    on their brand's and model's columns.
+    """
+
+    def __init__(self, columns, name_encoding='full'):
+        self.columns = list(columns)
+        self.name_encoding = name_encoding
+        self.width = len(self.columns)
+        self.index = {col: i for i, col in enumerate(self.columns)}
+        self.numeric_index = [self.index[col] for col in NUMERIC_FEATURES]
+
+        # One dict per categorical field: raw value -> column index.
+        # Values that were the dropped baseline (or never seen) are absent
+        # and simply leave every one-hot column for that field at zero.
+        self.category_index = {field: {} for field in CATEGORICAL_FEATURES}
+        for col, i in self.index.items():
+            for field in CATEGORICAL_FEATURES:
+                prefix = field + '_'
+                if col.startswith(prefix):
+                    self.category_index[field][col[len(prefix):]] = i
+                    break
+
+        # Hash bucket columns are contiguous; their count is the bucket count
+        hashed = [i for col, i in self.index.items() if col.startswith(HASH_PREFIX)]
+        self.hash_offset = hashed[0] if hashed else None
+        self.hash_buckets = len(hashed)
+        if name_encoding == 'hashed':
+            if not hashed:
+                raise ValueError("hashed name encoding needs name_hash_* columns")
+            self.category_index['name'] = {}
+
+    def encode(self, name, year, km_driven, fuel, seller_type, transmission, owner, out=None):
+        row = np.zeros(self.width) if out is None else out
+        row[self.numeric_index[0]] = year
+        row[self.numeric_index[1]] = km_driven
+        if self.name_encoding == 'brand':
+            name = brand_of(name)
+        elif self.name_encoding == 'hashed':
+            for b in name_buckets(name, self.hash_buckets):
+                row[self.hash_offset + b] += 1.0
+        values = (name, fuel, seller_type, transmission, owner)
+        for field, value in zip(CATEGORICAL_FEATURES, values):
+            i = self.category_index[field].get(value)
+            if i is not None:
+                row[i] = 1.0
+        return row
+
+    def encode_one(self, sparse=False, **fields):
+        if sparse:
+            return self.transform_sparse({field: [value] for field, value in fields.items()})
+        return self.encode(**fields).reshape(1, -1)
+
+    def name_hash_entries(self, names):
+        """(rows, columns) of every hashed name token, for the 'hashed' encoding.
+
+        Tokens are hashed once per distinct name; rows repeat a few thousand
+        names, so the per-row work is a gather. Missing names get no tokens.
+        """
+        import pandas as pd
+
+        inverse, uniques = pd.factorize(np.asarray(names, dtype=object), use_na_sentinel=True)
+        per_name = [name_buckets(name, self.hash_buckets) for name in uniques]
+        # factorize codes missing names -1; the extra zero-length slot at the
+        # end is where they gather from, instead of wrapping to the last name
+        lengths = np.array([len(b) for b in per_name] + [0], dtype=np.int64)
+        flat = np.fromiter((b for buckets in per_name for b in buckets), dtype=np.int64, count=lengths.sum())
+        starts = np.cumsum(lengths) - lengths
+
+        row_lengths = lengths[inverse]
+        total = int(row_lengths.sum())
+        rows = np.repeat(np.arange(len(inverse)), row_lengths)
+        within = np.arange(total) - np.repeat(np.cumsum(row_lengths) - row_lengths, row_lengths)
+        return rows, self.hash_offset + flat[np.repeat(starts[inverse], row_lengths) + within]
+
+    def category_codes(self, frame, field):
+        # Column index for every row of `field`, -1 where the value has no column
+        if field == 'name' and self.name_encoding == 'hashed':
+            return np.full(len(frame['year']), -1, dtype=np.int64)
+        lookup = self.category_index[field]
+        values = frame[field]
+        if field == 'name':
+            values = name_keys(values, self.name_encoding)
+        if hasattr(values, 'map'):
+            return values.map(lookup).fillna(-1).to_numpy(dtype=np.int64)
+        return np.array([lookup.get(value, -1) for value in values], dtype=np.int64)
+
+    def transform(self, frame, sparse=False):
+        if sparse:
+            return self.transform_sparse(frame)
+        n = len(frame)
+        X = np.zeros((n, self.width))
+        for col, i in zip(NUMERIC_FEATURES, self.numeric_index):
+            X[:, i] = frame[col].to_numpy(dtype=float)
+        rows = np.arange(n)
+        for field in CATEGORICAL_FEATURES:
+            codes = self.category_codes(frame, field)
+            hit = codes >= 0
+            X[rows[hit], codes[hit]] = 1.0
+        if self.name_encoding == 'hashed':
+            np.add.at(X, self.name_hash_entries(frame['name']), 1.0)
+        return X
+
+    def transform_sparse(self, frame):
+        # CSR rows hold the two numeric values plus one entry per matched
+        # category, so memory grows with non-zeros rather than rows x width.
+        # scipy is imported here so single-car scoring never pays for it.
+        import scipy.sparse as sp
+
+        n = len(frame['year'])
+        rows = np.arange(n)
+        row_parts, col_parts, data_parts = [], [], []
+        for col, i in zip(NUMERIC_FEATURES, self.numeric_index):
+            row_parts.append(rows)
+            col_parts.append(np.full(n, i))
+            data_parts.append(np.asarray(frame[col], dtype=float))
+        for field in CATEGORICAL_FEATURES:
+            codes = self.category_codes(frame, field)
+            hit = codes >= 0
+            row_parts.append(rows[hit])
+            col_parts.append(codes[hit])
+            data_parts.append(np.ones(hit.sum()))
+        if self.name_encoding == 'hashed':
+            hash_rows, hash_cols = self.name_hash_entries(frame['name'])
+            row_parts.append(hash_rows)
+            col_parts.append(hash_cols)
+            data_parts.append(np.ones(len(hash_rows)))
+        X = sp.coo_matrix(
+            (np.concatenate(data_parts), (np.concatenate(row_parts), np.concatenate(col_parts))),
+            shape=(n, self.width),
+        )
+        return X.tocsr()
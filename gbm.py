@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingRegressor
+
+from encoder import name_keys
+from tree_scorer import CODED_FEATURES, CategoryCodeEncoder, TreeScorer
+
+DEFAULT_PARAMS = {
+    'max_iter': 500,
+    'learning_rate': 0.05,
+    'max_leaf_nodes': 31,
+    'max_depth': 6,
+    'min_samples_leaf': 10,
+    'l2_regularization': 1.0,
+    'early_stopping': True,
+    'validation_fraction': 0.1,
+    'n_iter_no_change': 30,
+    'random_state': 42,
+}
+# Fields of the fitted predictors' private node records that flatten_trees reads
+NODE_FIELDS = {'is_leaf', 'feature_idx', 'num_threshold', 'left', 'right', 'value', 'missing_go_to_left', 'depth'}
+
+
+def ordered_categories(frame, target):
+    """Each coded field's values sorted by mean target, cheapest first.
+
+    With that order a single threshold on the integer code is the best
+    binary partition of the categories for squared error, so the trees
+    split categoricals without one-hot columns.
+    """
+    categories = {}
+    for field in CODED_FEATURES:
+        values = name_keys(frame['name'], 'brand') if field == 'brand' else frame[field]
+        means = pd.Series(target).groupby(np.asarray(values).astype(str)).mean()
+        categories[field] = [str(v) for v in means.sort_values(kind='stable').index]
+    return categories
+
+
+def flatten_trees(estimator):
+    """Copy a fitted HistGradientBoostingRegressor's trees into flat arrays.
+
+    Node indices are offset so all trees share one array per attribute.
+    Leaves get an infinite threshold, missing_left set and both children
+    pointing at themselves, which lets the level-wise evaluator keep
+    stepping rows that have already reached a leaf without a mask.
+
+    The node records are scikit-learn internals (written against 1.7-1.9),
+    so their layout is checked before anything is copied.
+    """
+    try:
+        nodes = [predictors[0].nodes for predictors in estimator._predictors]
+    except (AttributeError, IndexError, TypeError):
+        nodes = None
+    if nodes is None or any(not NODE_FIELDS <= set(n.dtype.names or ()) for n in nodes):
+        import sklearn
+        raise RuntimeError(f"cannot read the trees of scikit-learn {sklearn.__version__}'s "
+                           f"HistGradientBoostingRegressor; flatten_trees expects the 1.7-1.9 node layout")
+    sizes = np.array([len(n) for n in nodes])
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    flat = np.concatenate(nodes)
+    node_offset = np.repeat(offsets, sizes)
+    leaf = flat['is_leaf'].astype(bool)
+    index = np.arange(len(flat))
+
+    trees = {
+        'feature': np.where(leaf, 0, flat['feature_idx']).astype('<i4'),
+        'threshold': np.where(leaf, np.inf, flat['num_threshold']).astype('<f8'),
+        'left': np.where(leaf, index, flat['left'].astype(np.int64) + node_offset).astype('<i4'),
+        'right': np.where(leaf, index, flat['right'].astype(np.int64) + node_offset).astype('<i4'),
+        'value': np.where(leaf, flat['value'], 0.0).astype('<f8'),
+        'missing_left': (flat['missing_go_to_left'].astype(bool) | leaf).astype('u1'),
+        'roots': offsets.astype('<i4'),
+    }
+    max_depth = int(flat['depth'].max()) if len(flat) else 0
+    return trees, max_depth
+
+
+def fit_gbm(frame, target, params=None):
+    """Fit on integer-coded features; returns (TreeScorer, categories, trees, baseline, max_depth).
+
+    `target` is already in model space (log price for the default 'log' target).
+    """
+    categories = ordered_categories(frame, target)
+    encoder = CategoryCodeEncoder(categories)
+    X = encoder.transform(frame)
+    estimator = HistGradientBoostingRegressor(**dict(DEFAULT_PARAMS, **(params or {})))
+    estimator.fit(X, target)
+
+    trees, max_depth = flatten_trees(estimator)
+    scorer = TreeScorer(categories, trees, 0.0, max_depth)
+    # The baseline is whatever the trees leave unexplained; deriving it from
+    # predict() also checks the flattened trees reproduce the estimator
+    difference = estimator.predict(X) - scorer.raw_predict(X)
+    baseline = float(np.median(difference))
+    if np.max(np.abs(difference - baseline)) > 1e-6:
+        raise RuntimeError("flattened trees do not reproduce the fitted estimator")
+    scorer.baseline = baseline
+    return scorer, categories, trees, baseline, max_depth
+
@@ -0,0 +1,200 @@
+import os
+
+import numpy as np
+import scipy.linalg
+import scipy.sparse as sp
+
+from encoder import (FeatureEncoder, NUMERIC_FEATURES, CATEGORICAL_FEATURES, NAME_ENCODINGS, HASH_BUCKETS, HASH_PREFIX,
+                     hash_columns, name_keys, with_name_prefixes)
+
+STATE_PATH = 'training_state.npz'
+# Listings kept as a uniform sample of everything folded in, for calibrating
+# intervals without re-reading history
+CALIBRATION_ROWS = 20000
+CALIBRATION_FIELDS = ['name', 'year', 'km_driven', 'fuel', 'seller_type', 'transmission', 'owner', 'selling_price']
+
+
+class NormalEquationState:
+    """Sufficient statistics for refitting the linear model incrementally.
+
+    Keeps XᵀX, Xᵀy, yᵀy and the row count for an intercept-augmented design,
+    so a new batch of listings is folded in with work proportional to the
+    batch and the model is re-solved without revisiting history. Category
+    values seen for the first time add a column; earlier rows are zero in it,
+    so padding the accumulators with zeros keeps them exact. With hashed
+    names the name columns are fixed up front and never grow, and each
+    listing is folded in with its brand and brand + model copies, as in
+    the in-memory fit. A reservoir sample of up to `CALIBRATION_ROWS`
+    listings rides along, so intervals can be recalibrated against the
+    whole history rather than the latest batch.
+    """
+
+    def __init__(self, columns=None, offsets=None, name_encoding=None, hash_buckets=HASH_BUCKETS):
+        hashed = columns is not None and any(col.startswith(HASH_PREFIX) for col in columns)
+        if name_encoding is None:
+            # States saved before the encoding was recorded carry it in their columns
+            name_encoding = 'hashed' if hashed else 'full'
+        if name_encoding not in NAME_ENCODINGS:
+            raise ValueError(f"unknown name encoding {name_encoding!r}")
+        if columns is None:
+            columns = NUMERIC_FEATURES + (hash_columns(hash_buckets) if name_encoding == 'hashed' else [])
+        elif hashed != (name_encoding == 'hashed'):
+            raise ValueError(f"columns do not match the {name_encoding!r} name encoding")
+        self.columns = list(columns)
+        self.name_encoding = name_encoding
+        # Numeric columns are centred on fixed offsets (taken from the first
+        # batch) so the intercept and year columns are not nearly collinear
+        self.offsets = np.asarray(offsets, dtype=float) if offsets is not None else None
+        size = len(self.columns) + 1
+        self.xtx = np.zeros((size, size))
+        self.xty = np.zeros(size)
+        self.yty = 0.0
+        # Design rows behind the statistics, and the listings they came from
+        self.n_rows = 0
+        self.n_listings = 0
+        # Row hashes of every listing folded in so far, for ListingCleaner(seen=...)
+        self.seen = np.empty(0, dtype=np.uint64)
+        self.sample = None
+
+    @property
+    def width(self):
+        return len(self.columns)
+
+    def _grow(self, frame):
+        known = set(self.columns)
+        added = []
+        for field in CATEGORICAL_FEATURES:
+            if field == 'name' and self.name_encoding == 'hashed':
+                continue
+            values = frame[field].dropna()
+            if field == 'name' and self.name_encoding == 'brand':
+                values = name_keys(values, 'brand')
+            for value in values.unique():
+                col = f'{field}_{value}'
+                if col not in known:
+                    known.add(col)
+                    added.append(col)
+        if added:
+            self.columns.extend(added)
+            pad = len(added)
+            self.xtx = np.pad(self.xtx, ((0, pad), (0, pad)))
+            self.xty = np.pad(self.xty, (0, pad))
+        return added
+
+    def design(self, frame):
+        # [1 | year - offset | km - offset | one-hots] as CSR
+        onehot = FeatureEncoder(self.columns, self.name_encoding).transform_sparse(frame)[:, len(NUMERIC_FEATURES):]
+        dense = [np.ones(onehot.shape[0])]
+        for col, offset in zip(NUMERIC_FEATURES, self.offsets):
+            dense.append(np.asarray(frame[col], dtype=float) - offset)
+        return sp.hstack([sp.csr_matrix(np.column_stack(dense)), onehot], format='csr')
+
+    def partial_fit(self, frame, target='selling_price', grow=True):
+        # With grow=False the vocabulary is fixed and unseen values simply get
+        # no column, exactly as at prediction time
+        if self.offsets is None:
+            self.offsets = np.array([frame[col].mean() for col in NUMERIC_FEATURES], dtype=float)
+        added = self._grow(frame) if grow else []
+        self._sample(frame)
+        self.n_listings += len(frame)
+        if self.name_encoding == 'hashed':
+            frame = with_name_prefixes(frame)
+        X = self.design(frame)
+        y = np.asarray(frame[target], dtype=float)
+        self.xtx += (X.T @ X).toarray()
+        self.xty += X.T @ y
+        self.yty += float(y @ y)
+        self.n_rows += len(y)
+        return added
+
+    def _sample(self, frame, capacity=CALIBRATION_ROWS):
+        # Reservoir sampling (Algorithm R), vectorised over the batch: listing
+        # t overwrites a random slot j <= t when j < capacity. Seeded by the
+        # count so re-running the same batches gives the same sample
+        import pandas as pd
+
+        if not set(CALIBRATION_FIELDS) <= set(frame.columns):
+            return
+        new = {field: frame[field].to_numpy(dtype=object if field in CATEGORICAL_FEATURES else float)
+               for field in CALIBRATION_FIELDS}
+        held = 0 if self.sample is None else len(self.sample)
+        fill = min(capacity - held, len(frame))
+        t = self.n_listings + np.arange(fill, len(frame))
+        slots = np.random.default_rng(self.n_listings).integers(0, t + 1)
+        rows = np.arange(fill, len(frame))[slots < capacity]
+        slots = slots[slots < capacity]
+        # A later listing drawing the same slot wins, as in the sequential algorithm
+        last = len(slots) - 1 - np.unique(slots[::-1], return_index=True)[1]
+        columns = {}
+        for field, values in new.items():
+            old = (np.empty(0, dtype=values.dtype) if self.sample is None
+                   else self.sample[field].to_numpy(dtype=values.dtype))
+            column = np.concatenate([old, values[:fill]])
+            column[slots[last]] = values[rows[last]]
+            columns[field] = column
+        self.sample = pd.DataFrame(columns)
+
+    def solve(self, ridge=1e-10):
+        """Return (intercept, coef) for the current statistics.
+
+        The system is scaled to unit diagonal and given a tiny ridge so the
+        one-hot groups (which all sum to the intercept column, since no
+        baseline category is dropped) still factor with Cholesky.
+        """
+        if self.n_rows == 0:
+            raise ValueError("no rows have been added to the training state")
+        diag = np.diag(self.xtx).copy()
+        diag[diag == 0] = 1.0
+        scale = 1.0 / np.sqrt(diag)
+        A = self.xtx * scale[:, None] * scale[None, :]
+        A[np.diag_indices_from(A)] += ridge
+        beta = scipy.linalg.solve(A, self.xty * scale, assume_a='pos') * scale
+
+        coef = beta[1:]
+        intercept = beta[0] - float(coef[:len(NUMERIC_FEATURES)] @ self.offsets)
+        return intercept, coef
+
+    def rmse(self, intercept, coef):
+        # Residual sum of squares straight from the statistics:
+        # yᵀy - 2βᵀXᵀy + βᵀXᵀXβ, with β in the centred design's coordinates
+        beta = np.concatenate([[intercept + float(coef[:len(NUMERIC_FEATURES)] @ self.offsets)], coef])
+        rss = self.yty - 2 * float(beta @ self.xty) + float(beta @ self.xtx @ beta)
+        return float(np.sqrt(max(rss, 0.0) / self.n_rows))
+
+    def save(self, path=STATE_PATH):
+        tmp_path = path + '.tmp.npz'
+        sample = {} if self.sample is None else {
+            f'sample_{field}': self.sample[field].to_numpy(dtype=str if field in CATEGORICAL_FEATURES else float)
+            for field in CALIBRATION_FIELDS}
+        np.savez(tmp_path, columns=np.array(self.columns), offsets=self.offsets, name_encoding=self.name_encoding,
+                 xtx=self.xtx,
+                 xty=self.xty, yty=self.yty, n_rows=self.n_rows, n_listings=self.n_listings, seen=self.seen,
+                 **sample)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=STATE_PATH):
+        with np.load(path, allow_pickle=False) as data:
+            name_encoding = str(data['name_encoding']) if 'name_encoding' in data else None
+            state = cls(data['columns'].tolist(), data['offsets'], name_encoding)
+            state.xtx = data['xtx']
+            state.xty = data['xty']
+            state.yty = float(data['yty'])
+            state.n_rows = int(data['n_rows'])
+            state.n_listings = int(data['n_listings']) if 'n_listings' in data else state.n_rows
+            if 'seen' in data:
+                state.seen = data['seen']
+            if 'sample_name' in data:
+                import pandas as pd
+
+                state.sample = pd.DataFrame({field: data[f'sample_{field}'] for field in CALIBRATION_FIELDS})
+        return state
+
+    @staticmethod
+    def load_seen(path=STATE_PATH):
+        # Just the row hashes, without the XᵀX accumulators; empty if there is no state yet
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                return data['seen'] if 'seen' in data else np.empty(0, dtype=np.uint64)
+        except FileNotFoundError:
+            return np.empty(0, dtype=np.uint64)
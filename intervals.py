@@ -0,0 +1,159 @@
+import argparse
+
+import numpy as np
+
+from encoder import brand_of, name_keys
+
+DEFAULT_COVERAGE = 0.8
+# Brands with fewer calibration rows than this use the global quantiles
+MIN_SEGMENT_ROWS = 30
+
+
+class IntervalMixin:
+    """Prediction intervals from the residual quantiles in a scorer's metadata.
+
+    Scorers provide `metadata`, `target`, `_output` and the raw (pre-inverse
+    transform) scoring methods `raw_score`, `raw_score_frame` and `raw_predict`.
+    """
+
+    @property
+    def intervals(self):
+        # Per-brand residual quantiles written by training; None for uncalibrated models
+        return self.metadata.get('intervals')
+
+    def _bound(self, raw):
+        bound = self._output(raw)
+        return bound if self.target == 'log' else np.maximum(bound, 0.0)
+
+    def _segment_offsets(self, name):
+        intervals = self.intervals
+        return intervals['segments'].get(brand_of(name), intervals['global'])
+
+    def price_interval(self, name, year, km_driven, fuel, seller_type, transmission, owner):
+        """(low, high) prices at the model's calibrated coverage, or None.
+
+        The residual quantiles for the car's brand are added to its raw score,
+        so an interval costs one extra dict lookup on top of `price`.
+        """
+        if not self.intervals:
+            return None
+        raw = self.raw_score(name, year, km_driven, fuel, seller_type, transmission, owner)
+        low, high = self._segment_offsets(name)
+        return float(self._bound(raw + low)), float(self._bound(raw + high))
+
+    def interval_bounds(self, raw, names):
+        """Vectorised `price_interval` for raw scores from `raw_predict` or `raw_score_frame`."""
+        uniques, inverse = np.unique(np.asarray(names).astype(str), return_inverse=True)
+        offsets = np.array([self._segment_offsets(n) for n in uniques], dtype=float).reshape(-1, 2)[inverse]
+        raw = np.asarray(raw, dtype=float)
+        return self._bound(raw + offsets[:, 0]), self._bound(raw + offsets[:, 1])
+
+    def interval_frame(self, frame):
+        return self.interval_bounds(self.raw_score_frame(frame), frame['name'].to_numpy())
+
+    def predict_with_intervals(self, X, names):
+        # Prices plus (low, high) bounds from one raw scoring pass; bounds are
+        # None for uncalibrated models
+        raw = self.raw_predict(X)
+        low, high = self.interval_bounds(raw, names) if self.intervals else (None, None)
+        return self._output(raw), low, high
+
+
+def residual_quantiles(residuals, brands, coverage=DEFAULT_COVERAGE, min_rows=MIN_SEGMENT_ROWS):
+    """Lower/upper residual quantiles overall and per brand, for the artifact metadata.
+
+    Residuals are in the model's target space (price, or log price), so the
+    intervals are additive for price models and multiplicative for log ones.
+    """
+    residuals = np.asarray(residuals, dtype=float)
+    brands = np.asarray(brands).astype(str)
+    q = [(1 - coverage) / 2, (1 + coverage) / 2]
+    intervals = {
+        'coverage': coverage,
+        'segment': 'brand',
+        'rows': int(len(residuals)),
+        'global': np.quantile(residuals, q).tolist(),
+        'segments': {},
+    }
+    order = np.argsort(brands, kind='stable')
+    segments, starts, counts = np.unique(brands[order], return_index=True, return_counts=True)
+    for brand, start, count in zip(segments, starts, counts):
+        if count >= min_rows:
+            intervals['segments'][str(brand)] = np.quantile(residuals[order[start:start + count]], q).tolist()
+    return intervals
+
+
+def calibrate(scorer, frames, coverage=DEFAULT_COVERAGE, min_rows=MIN_SEGMENT_ROWS):
+    # `frames` is any iterable of listings with selling_price, so streamed
+    # chunks work as well as a single in-memory holdout
+    residuals, brands = [], []
+    for frame in frames:
+        y = frame['selling_price'].to_numpy(dtype=float)
+        target = np.log(y) if scorer.target == 'log' else y
+        residuals.append(target - scorer.raw_score_frame(frame))
+        brands.append(np.asarray(name_keys(frame['name'], 'brand')).astype(str))
+    return residual_quantiles(np.concatenate(residuals), np.concatenate(brands), coverage, min_rows)
+
+
+def empirical_coverage(scorer, frame):
+    low, high = scorer.interval_frame(frame)
+    y = frame['selling_price'].to_numpy(dtype=float)
+    return float(np.mean((y >= low) & (y <= high)))
+
+
+def main(argv=None):
+    from sklearn.model_selection import train_test_split
+
+    from artifact import ARTIFACT_PATH, file_sha256, load_artifact, save_artifact
+    from cleaning import ListingCleaner
+    from ingest import CSV_PATH, load_listings
+    from model_store import scorer_from_artifact
+    from train_model import HOLDOUT_FRACTION, SPLIT_SEED, TRAINING_COLUMNS
+
+    parser = argparse.ArgumentParser(
+        description="Recalibrate an existing artifact's prediction intervals on the training holdout.")
+    parser.add_argument('--model', default=ARTIFACT_PATH)
+    parser.add_argument('--coverage', type=float, default=DEFAULT_COVERAGE)
+    args = parser.parse_args(argv)
+
+    artifact = load_artifact(args.model)
+    scorer = scorer_from_artifact(artifact)
+    data = load_listings(TRAINING_COLUMNS)
+    cleaning = artifact.metadata.get('cleaning')
+    if cleaning is not None:
+        # Training split the cleaned listings; clean them the same way so
+        # the holdout here is the rows the model was not fitted on
+        data = ListingCleaner(cleaning.get('reference_year')).clean(data)
+    # The split is only a holdout for a full fit on this same file; stream,
+    # incremental and search runs fitted every row, and another file's
+    # model never saw these rows at all
+    mode = artifact.metadata.get('mode', 'full')
+    trained_on = artifact.metadata.get('dataset_sha256')
+    if trained_on is not None and trained_on != file_sha256(CSV_PATH):
+        source, reason = 'listings', f"the model was trained on another dataset than {CSV_PATH}"
+    elif mode != 'full':
+        source, reason = 'train', f"a {mode} model was fitted on every row, holdout included"
+    else:
+        source, reason = None, None
+    if reason is None:
+        _, test_idx = train_test_split(np.arange(len(data)), test_size=HOLDOUT_FRACTION, random_state=SPLIT_SEED)
+        rows, label = data.iloc[test_idx], "holdout rows"
+    else:
+        print(f" No holdout: {reason}; calibrating on all listings, so coverage is not out-of-sample")
+        rows, label = data, "training rows" if source == 'train' else "listings"
+
+    calibrated = calibrate(scorer, [rows], args.coverage)
+    if source is not None:
+        calibrated['source'] = source
+    metadata = dict(artifact.metadata, intervals=calibrated)
+    arrays = {name: np.array(a) for name, a in artifact.arrays.items()}
+    lazy = {name for name, spec in artifact.header['arrays'].items() if spec.get('lazy')}
+    save_artifact(args.model, artifact.vocabulary, arrays, artifact.model, metadata, lazy)
+
+    scorer.metadata = metadata
+    print(f" Calibrated {args.coverage:.0%} intervals for {len(metadata['intervals']['segments'])} brands "
+          f"on {len(rows):,} {label} (empirical coverage {empirical_coverage(scorer, rows):.1%})")
+
+
+if __name__ == '__main__':
+    main()
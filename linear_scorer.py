@@ -0,0 +1,118 @@
+import numpy as np
+
+from artifact import load_artifact, ARTIFACT_PATH
+from encoder import FeatureEncoder, NUMERIC_FEATURES, CATEGORICAL_FEATURES, HASH_PREFIX, brand_of, name_buckets, name_keys
+from intervals import IntervalMixin
+
+
+class LinearScorer(IntervalMixin):
+    """Prices a car from a linear model artifact, without scikit-learn.
+
+    A linear model's prediction is the intercept, plus the year and km terms,
+    plus one coefficient per categorical field, so scoring a car is a few dict
+    lookups rather than building and validating a 1,503-wide row.
+    """
+
+    def __init__(self, columns, coef, intercept, version=None, metadata=None,
+                 target='price', name_encoding='full'):
+        self.columns = list(columns)
+        self.coef_ = np.asarray(coef, dtype=float)
+        self.intercept_ = float(intercept)
+        # 'log' models are fitted on log(price) and exponentiated on the way out
+        self.target = target
+        self.name_encoding = name_encoding
+        self.version = version
+        self.metadata = metadata or {}
+        coefficients = dict(zip(self.columns, self.coef_.tolist()))
+        self.numeric_coef = [coefficients[col] for col in NUMERIC_FEATURES]
+
+        # field -> {raw value: coefficient}; baseline/unseen values score 0
+        self.category_coef = {field: {} for field in CATEGORICAL_FEATURES}
+        for col, c in coefficients.items():
+            for field in CATEGORICAL_FEATURES:
+                prefix = field + '_'
+                if col.startswith(prefix):
+                    self.category_coef[field][col[len(prefix):]] = c
+                    break
+        # Hashed names score the sum of their token buckets' coefficients
+        self.hash_coef = np.array([c for col, c in coefficients.items() if col.startswith(HASH_PREFIX)])
+        if name_encoding == 'hashed':
+            self.category_coef['name'] = {}
+
+    @classmethod
+    def from_artifact(cls, artifact):
+        if artifact.model.get('kind') != 'linear':
+            raise ValueError(f"LinearScorer cannot serve a '{artifact.model.get('kind')}' model")
+        model = artifact.model
+        return cls(artifact.vocabulary, artifact.arrays['coef'], model['intercept'],
+                   artifact.version, artifact.metadata,
+                   model.get('target', 'price'), model.get('name_encoding', 'full'))
+
+    @classmethod
+    def load(cls, path=ARTIFACT_PATH):
+        return cls.from_artifact(load_artifact(path))
+
+    def make_encoder(self):
+        return FeatureEncoder(self.columns, self.name_encoding)
+
+    def _output(self, raw):
+        return np.exp(raw) if self.target == 'log' else raw
+
+    def price(self, name, year, km_driven, fuel, seller_type, transmission, owner):
+        return self._output(self.raw_score(name, year, km_driven, fuel, seller_type, transmission, owner))
+
+    def raw_score(self, name, year, km_driven, fuel, seller_type, transmission, owner):
+        # The linear score before the inverse target transform
+        cat = self.category_coef
+        if self.name_encoding == 'brand':
+            name = brand_of(name)
+        return (self.intercept_
+                + self.numeric_coef[0] * year
+                + self.numeric_coef[1] * km_driven
+                + self.name_score(name)
+                + cat['fuel'].get(fuel, 0.0)
+                + cat['seller_type'].get(seller_type, 0.0)
+                + cat['transmission'].get(transmission, 0.0)
+                + cat['owner'].get(owner, 0.0))
+
+    def name_score(self, name):
+        if self.name_encoding == 'hashed':
+            return float(sum(self.hash_coef[b] for b in name_buckets(name, len(self.hash_coef))))
+        return self.category_coef['name'].get(name, 0.0)
+
+    def price_grid(self, years, km_values, name, fuel, seller_type, transmission, owner):
+        """Prices for every (year, km_driven) pair as a len(years) x len(km_values) array.
+
+        Year and km enter the score linearly, so the grid is one base score
+        plus an outer sum of the two terms.
+        """
+        base = self.raw_score(name, 0, 0, fuel, seller_type, transmission, owner)
+        years = np.asarray(years, dtype=float)
+        km_values = np.asarray(km_values, dtype=float)
+        grid = base + self.numeric_coef[0] * years[:, None] + self.numeric_coef[1] * km_values[None, :]
+        return self._output(grid)
+
+    def raw_score_frame(self, frame):
+        scores = (self.intercept_
+                  + self.numeric_coef[0] * frame['year'].to_numpy(dtype=float)
+                  + self.numeric_coef[1] * frame['km_driven'].to_numpy(dtype=float))
+        for field in CATEGORICAL_FEATURES:
+            values = frame[field]
+            lookup = self.category_coef[field]
+            if field == 'name' and self.name_encoding == 'hashed':
+                lookup = {name: self.name_score(name) for name in values.unique()}
+            elif field == 'name':
+                values = name_keys(values, self.name_encoding)
+            scores += values.map(lookup).fillna(0.0).to_numpy(dtype=float)
+        return scores
+
+    def predict_frame(self, frame):
+        return self._output(self.raw_score_frame(frame))
+
+    def raw_predict(self, X):
+        return np.asarray(X @ self.coef_).ravel() + self.intercept_
+
+    def predict(self, X):
+        # Same contract as the sklearn model for rows from make_encoder()
+        return self._output(self.raw_predict(X))
+
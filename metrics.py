@@ -0,0 +1,203 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+METRICS_PATH = 'metrics.prom'
+# Upper bounds in seconds, from 50 us up to 5 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in sorted(labels.items())) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Metrics:
+    """Process-wide counters, gauges and latency histograms.
+
+    Every series is keyed by a metric name plus labels, and `render()`
+    produces the Prometheus text exposition format, so the same data can be
+    served from /metrics or dumped to a file a node exporter picks up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, _labels(labels))] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def stage(self, stage, **labels):
+        # Latency lands in stage_seconds, failures in stage_errors_total
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('stage_errors_total', stage=stage, **labels)
+            raise
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - started, stage=stage, **labels)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for kind, series in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({n for n, _ in series}):
+                    lines.append(f'# TYPE {name} {kind}')
+                    lines.extend(f'{name}{labels} {value}' for (n, labels), value in sorted(series.items())
+                                 if n == name)
+            for name in sorted({n for n, _ in self.histograms}):
+                lines.append(f'# TYPE {name} histogram')
+                for (n, labels), h in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    inner = labels[1:-1]
+                    cumulative = 0
+                    for bound, count in zip(h.buckets + (float('inf'),), h.counts + [h.count - sum(h.counts)]):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'{name}_bucket{{{inner + "," if inner else ""}le="{le}"}} {cumulative}')
+                    lines.append(f'{name}_sum{labels} {h.sum}')
+                    lines.append(f'{name}_count{labels} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path=METRICS_PATH):
+        # Each call gets its own temp file: app sessions are threads of one
+        # process and may dump at the same time
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                        dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            # mkstemp makes the file owner-only; scrapers read it as another user
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.render())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+METRICS = Metrics()
+
+
+def track_cache(cache, name=None, metrics=METRICS):
+    """Wrap a function in a Streamlit cache decorator and count hits and misses.
+
+    The wrapped body only runs on a miss, so lookups minus misses is the
+    number of hits.
+    """
+    def decorate(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def compute(*args, **kwargs):
+            metrics.inc('cache_misses_total', cache=label)
+            return fn(*args, **kwargs)
+
+        cached = cache(compute)
+
+        @functools.wraps(fn)
+        def lookup(*args, **kwargs):
+            metrics.inc('cache_lookups_total', cache=label)
+            return cached(*args, **kwargs)
+
+        lookup.clear = cached.clear
+        return lookup
+    return decorate
+
+
+class RequestProfiler:
+    """cProfile + tracemalloc for one request, switched on by a per-request flag.
+
+    With `enabled` False, start() and stop() do nothing and stop() returns
+    None, so call sites can pass the flag straight through.
+    """
+
+    def __init__(self, enabled=True, top=20):
+        self.enabled = enabled
+        self.top = top
+        self._profiler = None
+        self._started_tracing = False
+
+    def start(self):
+        if not self.enabled:
+            return self
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+        return self
+
+    def stop(self):
+        if self._profiler is None:
+            return None
+        self._profiler.disable()
+        current, peak = tracemalloc.get_traced_memory()
+        allocations = tracemalloc.take_snapshot().statistics('lineno')[:self.top]
+        if self._started_tracing:
+            tracemalloc.stop()
+        stream = io.StringIO()
+        pstats.Stats(self._profiler, stream=stream).sort_stats('cumulative').print_stats(self.top)
+        self._profiler = None
+        return {
+            'cpu': stream.getvalue(),
+            'peak_bytes': peak,
+            'current_bytes': current,
+            'allocations': [str(stat) for stat in allocations],
+        }
+
+
+@contextmanager
+def profiled(enabled=True, top=20):
+    # Context-manager form of RequestProfiler; the yielded dict is filled on exit
+    report = {}
+    profiler = RequestProfiler(enabled, top).start()
+    try:
+        yield report
+    finally:
+        report.update(profiler.stop() or {})
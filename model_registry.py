@@ -0,0 +1,85 @@
+import logging
+import threading
+
+from model_store import MODEL_PATH, load_scorer
+from prediction_cache import file_signature
+
+DEFAULT_POLL_INTERVAL = 2.0
+# For the processes that host a registry; the active version and swaps are logged at INFO
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """Holds the active model and hot-swaps in new versions of its artifact.
+
+    A daemon thread polls the artifact's mtime/size every `interval` seconds.
+    A changed file is loaded and validated on that thread, off the request
+    path, and only replaces the active model if it loaded cleanly. The swap
+    is a single reference assignment, so a caller that already took
+    `current()` finishes on the version it started with.
+    """
+
+    def __init__(self, model_path=MODEL_PATH, interval=DEFAULT_POLL_INTERVAL, loader=load_scorer,
+                 watch=True):
+        self.model_path = model_path
+        self.interval = interval
+        self.loader = loader
+        self.swaps = 0
+        self.failures = 0
+        self.last_error = None
+        self._signature = file_signature(model_path)
+        self._model = loader(model_path)
+        self._stop = threading.Event()
+        logger.info("Serving model version %s from %s", self.version, model_path)
+
+        self._watcher = None
+        if watch:
+            self._watcher = threading.Thread(target=self._run, name='model-registry', daemon=True)
+            self._watcher.start()
+
+    def current(self):
+        return self._model
+
+    @property
+    def version(self):
+        return self._model.version
+
+    def check(self):
+        """Load the artifact if it changed since the last check; True if a new model was swapped in."""
+        signature = file_signature(self.model_path)
+        if signature is None or signature == self._signature:
+            return False
+        # Remember the signature even if loading fails, so a bad file is
+        # reported once rather than on every poll
+        self._signature = signature
+        try:
+            model = self.loader(self.model_path)
+        except Exception as exc:
+            self.failures += 1
+            self.last_error = f"{type(exc).__name__}: {exc}"
+            logger.error("Keeping model version %s; %s failed to load: %s",
+                         self.version, self.model_path, self.last_error)
+            return False
+        if model.version == self.version:
+            return False
+
+        previous = self.version
+        self._model = model
+        self.swaps += 1
+        self.last_error = None
+        logger.info("Swapped model version %s -> %s", previous, model.version)
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Model registry check failed")
+
+    def stop(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
@@ -0,0 +1,194 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.linear_model import Lasso, LinearRegression, Ridge
+from sklearn.model_selection import KFold
+
+from encoder import FeatureEncoder, NAME_ENCODINGS, build_columns, with_name_prefixes
+
+TARGETS = ['price', 'log']
+RIDGE_ALPHAS = [0.1, 1.0, 10.0]
+# Lasso's penalty is on the target's scale, so alphas are relative to std(y)
+LASSO_ALPHAS = [1e-4, 1e-3, 1e-2]
+# Log-space predictions are clipped before exp() so a wild fold cannot overflow
+MAX_LOG_PRICE = 25.0
+
+
+def candidate_grid(name_encodings=NAME_ENCODINGS, targets=TARGETS):
+    models = [('ols', None)]
+    models += [('ridge', a) for a in RIDGE_ALPHAS]
+    models += [('lasso', a) for a in LASSO_ALPHAS]
+    return [
+        {'model': model, 'alpha': alpha, 'target': target, 'name_encoding': encoding}
+        for encoding, target, (model, alpha) in itertools.product(name_encodings, targets, models)
+    ]
+
+
+def make_estimator(candidate, y):
+    if candidate['model'] == 'ols':
+        return LinearRegression(tol=1e-10)
+    if candidate['model'] == 'ridge':
+        return Ridge(alpha=candidate['alpha'], solver='sparse_cg', tol=1e-8)
+    if candidate['model'] == 'lasso':
+        return Lasso(alpha=candidate['alpha'] * float(np.std(y)), max_iter=5000, tol=1e-4)
+    raise ValueError(f"unknown model {candidate['model']!r}")
+
+
+def column_scale(X):
+    # Max-abs scale so the penalties treat year/km_driven like the 0/1 dummies;
+    # coefficients are divided by the same factors afterwards
+    scale = np.asarray(abs(X).max(axis=0).todense()).ravel()
+    scale[scale == 0] = 1.0
+    return scale
+
+
+def fit_candidate(candidate, X, y, scale):
+    target = np.log(y) if candidate['target'] == 'log' else y
+    estimator = make_estimator(candidate, target)
+    estimator.fit(X @ sp.diags(1.0 / scale), target)
+    coef = np.ravel(estimator.coef_) / scale
+    return coef, float(estimator.intercept_)
+
+
+def predict_price(candidate, coef, intercept, X):
+    raw = np.asarray(X @ coef).ravel() + intercept
+    if candidate['target'] == 'log':
+        return np.exp(np.minimum(raw, MAX_LOG_PRICE))
+    return raw
+
+
+def design_rows(data, name_encoding):
+    """(rows, origins): the rows a candidate is fitted on and the listing each came from.
+
+    Hashed candidates are fitted on every listing plus its brand and brand +
+    model copies, as train_model does, so the brand tokens are identified.
+    The listings themselves come first, so row i < len(data) is listing i.
+    """
+    if name_encoding != 'hashed':
+        return data, np.arange(len(data))
+    rows = with_name_prefixes(data.assign(_origin=np.arange(len(data))))
+    return rows, rows.pop('_origin').to_numpy()
+
+
+class SharedMatrices:
+    """Encoded CSR matrices, their rows' listings and the target placed in shared memory once.
+
+    Worker processes attach to the same blocks instead of each receiving a
+    pickled copy of every matrix with every task.
+    """
+
+    def __init__(self, matrices, y, origins):
+        self._blocks = []
+        self.spec = {'y': self._share(np.asarray(y, dtype=float)), 'matrices': {}}
+        for key, X in matrices.items():
+            X = X.tocsr()
+            self.spec['matrices'][key] = {
+                'shape': X.shape,
+                'data': self._share(X.data),
+                'indices': self._share(X.indices),
+                'indptr': self._share(X.indptr),
+                'origins': self._share(np.asarray(origins[key], dtype=np.int64)),
+            }
+
+    def _share(self, array):
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        self._blocks.append(block)
+        return (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+_worker = {}
+
+
+def _attach(spec):
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    _worker.setdefault('blocks', []).append(block)
+    array = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+    array.flags.writeable = False
+    return array
+
+
+def _init_worker(spec):
+    _worker['y'] = _attach(spec['y'])
+    _worker['matrices'] = {}
+    _worker['origins'] = {}
+    for key, m in spec['matrices'].items():
+        parts = (_attach(m['data']), _attach(m['indices']), _attach(m['indptr']))
+        _worker['matrices'][key] = sp.csr_matrix(parts, shape=m['shape'], copy=False)
+        _worker['origins'][key] = _attach(m['origins'])
+
+
+def _score_fold(task):
+    index, candidate, train_idx, test_idx = task
+    X = _worker['matrices'][candidate['name_encoding']]
+    origins = _worker['origins'][candidate['name_encoding']]
+    y = _worker['y']
+    # Fit on every design row whose listing is in the training fold; score
+    # the held-out listings only, never their derived copies
+    in_train = np.zeros(len(y), dtype=bool)
+    in_train[train_idx] = True
+    fit_rows = np.flatnonzero(in_train[origins])
+    X_train, X_test = X[fit_rows], X[test_idx]
+    coef, intercept = fit_candidate(candidate, X_train, y[origins[fit_rows]], column_scale(X_train))
+    residuals = y[test_idx] - predict_price(candidate, coef, intercept, X_test)
+    return index, float(np.sqrt(np.mean(residuals ** 2))), float(np.mean(np.abs(residuals)))
+
+
+def search(data, folds=5, workers=None, candidates=None, seed=42):
+    """Cross-validate every candidate; returns (leaderboard, encoders, matrices, origins).
+
+    Each (candidate, fold) pair is one task in a process pool; all tasks
+    read the same shared, read-only encoded matrices.
+    """
+    candidates = candidates or candidate_grid()
+    y = data['selling_price'].to_numpy(dtype=float)
+    encoders = {}
+    matrices = {}
+    origins = {}
+    for encoding in sorted({c['name_encoding'] for c in candidates}):
+        encoders[encoding] = FeatureEncoder(build_columns(data, name_encoding=encoding), encoding)
+        rows, origins[encoding] = design_rows(data, encoding)
+        matrices[encoding] = encoders[encoding].transform_sparse(rows)
+
+    splits = list(KFold(n_splits=folds, shuffle=True, random_state=seed).split(y))
+    tasks = [(i, c, train_idx, test_idx)
+             for i, c in enumerate(candidates) for train_idx, test_idx in splits]
+
+    workers = workers or os.cpu_count() or 1
+    shared = SharedMatrices(matrices, y, origins)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(shared.spec,)) as pool:
+            scores = list(pool.map(_score_fold, tasks, chunksize=max(1, len(tasks) // (4 * workers))))
+    finally:
+        shared.close()
+
+    leaderboard = []
+    for i, candidate in enumerate(candidates):
+        rmse = [r for j, r, _ in scores if j == i]
+        mae = [m for j, _, m in scores if j == i]
+        leaderboard.append(dict(candidate, cv_rmse=float(np.mean(rmse)), cv_rmse_std=float(np.std(rmse)),
+                                cv_mae=float(np.mean(mae))))
+    leaderboard.sort(key=lambda r: r['cv_rmse'])
+    return leaderboard, encoders, matrices, origins
+
+
+def fit_best(leaderboard, encoders, matrices, y, origins=None):
+    # `origins` maps each design row to its listing; without it rows are listings
+    best = leaderboard[0]
+    X = matrices[best['name_encoding']]
+    if origins is not None:
+        y = np.asarray(y)[origins[best['name_encoding']]]
+    coef, intercept = fit_candidate(best, X, y, column_scale(X))
+    return best, encoders[best['name_encoding']].columns, coef, intercept
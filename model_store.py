@@ -0,0 +1,35 @@
+import numpy as np
+
+from artifact import ARTIFACT_PATH, load_artifact
+from linear_scorer import LinearScorer
+from segments import SegmentRouter
+from tree_scorer import TreeScorer
+
+MODEL_PATH = ARTIFACT_PATH
+SCORERS = {'linear': LinearScorer, 'gbm': TreeScorer, 'segmented': SegmentRouter}
+
+
+def load_models(model_path=MODEL_PATH):
+    # A single versioned artifact holds the coefficients and the column
+    # vocabulary, checked against each other before anything is served
+    scorer = load_scorer(model_path)
+    return scorer, scorer.columns
+
+
+def scorer_from_artifact(artifact):
+    kind = artifact.model.get('kind')
+    if kind not in SCORERS:
+        raise ValueError(f"No scorer for '{kind}' models")
+    return SCORERS[kind].from_artifact(artifact)
+
+
+def load_scorer(model_path=MODEL_PATH):
+    # The artifact's model kind picks the scorer, so swapping a linear
+    # model.bin for a tree ensemble needs no code or config change
+    return scorer_from_artifact(load_artifact(model_path))
+
+
+def predict(model, X):
+    # LinearScorer.predict is X @ coef + intercept (plus the inverse target
+    # transform), which keeps CSR inputs sparse end to end
+    return np.asarray(model.predict(X)).ravel()
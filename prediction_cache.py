@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from model_store import MODEL_PATH
+
+DEFAULT_MAXSIZE = 4096
+DEFAULT_KM_BUCKET = 1000
+
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class PredictionCache:
+    """Bounded LRU cache of predicted prices with optional TTL.
+
+    Keys are the normalized input tuple, with km_driven rounded to
+    `km_bucket` so nearby odometer readings share an entry. The whole cache
+    is dropped as soon as the model artifact's mtime or size changes, or,
+    when `signature` is given, as soon as that callable (e.g. a registry's
+    active version) returns something new.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=None, km_bucket=DEFAULT_KM_BUCKET,
+                 model_path=MODEL_PATH, clock=time.monotonic, signature=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.km_bucket = km_bucket
+        self.model_path = model_path
+        self.clock = clock
+        self.signature = signature or (lambda: file_signature(model_path))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._signature = self.signature()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def normalize(self, name, year, km_driven, fuel, seller_type, transmission, owner):
+        km = km_driven
+        if self.km_bucket:
+            km = int(round(km_driven / self.km_bucket) * self.km_bucket)
+        return (str(name).strip(), int(year), km, str(fuel).strip(), str(seller_type).strip(),
+                str(transmission).strip(), str(owner).strip())
+
+    def _check_model(self):
+        signature = self.signature()
+        if signature != self._signature:
+            self._entries.clear()
+            self._signature = signature
+            self.invalidations += 1
+
+    def get_or_compute(self, compute, version=None, **fields):
+        """Return the cached price for `fields`, calling `compute` on a miss.
+
+        `compute` receives the normalized fields, so every input that maps to
+        the same key gets the same price whether or not it was cached. If
+        `version` (the version of the model behind `compute`) differs from the
+        current signature, the cache is bypassed so an older model's price is
+        never stored under a newer model.
+        """
+        key = self.normalize(**fields)
+        now = self.clock()
+        with self._lock:
+            self._check_model()
+            signature = self._signature
+            current = version is None or version == signature
+            entry = self._entries.get(key) if current else None
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+
+        value = compute(*key)
+
+        with self._lock:
+            self._check_model()
+            # `compute` is behind the current model, or the model was swapped
+            # while it ran: return the value but don't keep it
+            if not current or self._signature != signature:
+                return value
+            expires = now + self.ttl if self.ttl else None
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
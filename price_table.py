@@ -0,0 +1,298 @@
+import argparse
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+from encoder import INPUT_FIELDS, name_keys
+from prediction_cache import file_signature
+
+PRICE_TABLE_PATH = 'price_table.npz'
+# A configuration is everything about a car except its odometer reading
+CONFIG_FIELDS = ['name', 'year', 'fuel', 'seller_type', 'transmission', 'owner']
+# Configurations need at least this many listings to get a row in the table
+MIN_LISTINGS = 2
+# Requests mostly carry round odometer readings; each row covers 0, KM_STEP, ... KM_MAX
+KM_STEP = 5000
+KM_MAX = 200000
+DEFAULT_POLL_INTERVAL = 2.0
+
+logger = logging.getLogger(__name__)
+
+
+class PriceTable:
+    """Prices precomputed by the offline job for common configurations.
+
+    Row i of `prices` holds configuration `configs[i]` priced at every
+    multiple of `km_step` from 0 to the last column, so a lookup is one
+    dict probe for the row and one division for the column. Anything else
+    (an unlisted configuration, an odometer reading off the grid, or a
+    table built for a different model version than the one serving) is a
+    miss and the caller falls back to the model.
+    """
+
+    def __init__(self, configs, km_step, prices, low=None, high=None, model_version=None, metadata=None):
+        self.configs = [self.key(*config) for config in configs]
+        self.index = {config: i for i, config in enumerate(self.configs)}
+        self.km_step = int(km_step)
+        self.prices = np.asarray(prices, dtype=float)
+        self.low = None if low is None else np.asarray(low, dtype=float)
+        self.high = None if high is None else np.asarray(high, dtype=float)
+        self.model_version = model_version
+        self.metadata = metadata or {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    @property
+    def n_km(self):
+        return self.prices.shape[1]
+
+    @property
+    def size(self):
+        return self.prices.size
+
+    @staticmethod
+    def key(name, year, fuel, seller_type, transmission, owner):
+        # Same normalization as PredictionCache, so both agree on what "the same car" is
+        return (str(name).strip(), int(year), str(fuel).strip(), str(seller_type).strip(),
+                str(transmission).strip(), str(owner).strip())
+
+    def _position(self, name, year, km_driven, fuel, seller_type, transmission, owner):
+        row = self.index.get(self.key(name, year, fuel, seller_type, transmission, owner))
+        column, remainder = divmod(km_driven, self.km_step)
+        if row is None or remainder or not 0 <= column < self.n_km:
+            return None
+        return row, int(column)
+
+    def lookup(self, version, name, year, km_driven, fuel, seller_type, transmission, owner):
+        """(price, (low, high) or None) for the car, or None if the model must price it.
+
+        `version` is the version of the model that would otherwise answer; a
+        table built for any other version is stale and never answers.
+        """
+        position = None
+        if version == self.model_version:
+            position = self._position(name, year, km_driven, fuel, seller_type, transmission, owner)
+        with self._lock:
+            if version != self.model_version:
+                self.stale += 1
+            elif position is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if position is None:
+            return None
+        bound = None if self.low is None else (float(self.low[position]), float(self.high[position]))
+        return float(self.prices[position]), bound
+
+    def stats(self, version=None):
+        lookups = self.hits + self.misses + self.stale
+        return {
+            'configurations': len(self.configs),
+            'entries': self.size,
+            'model_version': self.model_version,
+            'stale': version is not None and version != self.model_version,
+            'created_at': self.metadata.get('created_at'),
+            'coverage': self.metadata.get('coverage'),
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale_lookups': self.stale,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def save(self, path=PRICE_TABLE_PATH):
+        columns = list(zip(*self.configs)) if self.configs else [[]] * len(CONFIG_FIELDS)
+        arrays = {field: np.array(values, dtype=np.int64 if field == 'year' else str)
+                  for field, values in zip(CONFIG_FIELDS, columns)}
+        arrays['prices'] = self.prices
+        if self.low is not None:
+            arrays['low'], arrays['high'] = self.low, self.high
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, km_step=self.km_step, model_version=str(self.model_version),
+                 created_at=self.metadata.get('created_at', ''), min_listings=self.metadata.get('min_listings', 0),
+                 coverage=np.array([self.metadata.get('coverage', {}).get(level, np.nan)
+                                    for level in ('name', 'brand')]),
+                 **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=PRICE_TABLE_PATH):
+        with np.load(path, allow_pickle=False) as data:
+            configs = zip(*(data[field].tolist() for field in CONFIG_FIELDS))
+            low, high = (data['low'], data['high']) if 'low' in data else (None, None)
+            coverage = dict(zip(('name', 'brand'), data['coverage'].tolist()))
+            metadata = {'created_at': str(data['created_at']), 'min_listings': int(data['min_listings']),
+                        'coverage': coverage}
+            return cls(configs, int(data['km_step']), data['prices'], low, high, str(data['model_version']),
+                       metadata)
+
+
+def load_price_table(path=PRICE_TABLE_PATH):
+    # A missing table just means every request goes to the model
+    try:
+        return PriceTable.load(path)
+    except FileNotFoundError:
+        return None
+
+
+class PriceTableWatcher:
+    """Holds the current price table and swaps in the file whenever it is rebuilt.
+
+    Polls the file's mtime/size like ModelRegistry does for the model, so
+    the table rebuilt after a retrain is picked up without a restart and
+    lookups stop falling through as stale. `current()` is None while there
+    is no table; a file that fails to load leaves the previous table in use.
+    """
+
+    def __init__(self, path=PRICE_TABLE_PATH, interval=DEFAULT_POLL_INTERVAL, watch=True):
+        self.path = path
+        self.interval = interval
+        self.swaps = 0
+        self.last_error = None
+        self._signature = file_signature(path)
+        self._table = load_price_table(path)
+        self._stop = threading.Event()
+        self._watcher = None
+        if watch:
+            self._watcher = threading.Thread(target=self._run, name='price-table', daemon=True)
+            self._watcher.start()
+
+    def current(self):
+        return self._table
+
+    def check(self):
+        """Reload the table if its file changed since the last check; True if it was swapped."""
+        signature = file_signature(self.path)
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        try:
+            table = load_price_table(self.path)
+        except Exception as exc:
+            self.last_error = f"{type(exc).__name__}: {exc}"
+            logger.error("Keeping the current price table; %s failed to load: %s", self.path, self.last_error)
+            return False
+        self._table = table
+        self.swaps += 1
+        self.last_error = None
+        if table is None:
+            logger.info("Price table %s removed; every lookup goes to the model", self.path)
+        else:
+            logger.info("Loaded price table for model %s (%s configurations)", table.model_version,
+                        f"{len(table.configs):,}")
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Price table check failed")
+
+    def stop(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+
+
+def common_configurations(listings, min_listings=MIN_LISTINGS):
+    """Configurations listed at least `min_listings` times, keyed by full name and by brand alone.
+
+    The app asks by brand and the HTTP API usually by full model name, so
+    both spellings of a frequent configuration get a row. `listings` should
+    already be cleaned: a re-posted listing would otherwise count twice.
+    """
+    import pandas as pd
+
+    levels = []
+    for names in (listings['name'], name_keys(listings['name'], 'brand')):
+        counts = listings[CONFIG_FIELDS].assign(name=names).groupby(CONFIG_FIELDS, sort=True).size()
+        levels.append(counts[counts >= min_listings].index.to_frame(index=False))
+    return pd.concat(levels, ignore_index=True).drop_duplicates(CONFIG_FIELDS, ignore_index=True)
+
+
+def table_coverage(table, listings):
+    """Share of listings the table answers when each is requested by full name and by brand."""
+    import pandas as pd
+
+    on_grid = ((listings['km_driven'] % table.km_step == 0)
+               & (listings['km_driven'] < table.km_step * table.n_km)).to_numpy()
+    configs = pd.MultiIndex.from_tuples(table.configs, names=CONFIG_FIELDS)
+    coverage = {}
+    for level, names in (('name', listings['name']), ('brand', name_keys(listings['name'], 'brand'))):
+        listed = pd.MultiIndex.from_frame(listings[CONFIG_FIELDS].assign(name=names)).isin(configs)
+        coverage[level] = float(np.mean(listed & on_grid)) if len(listings) else 0.0
+    return coverage
+
+
+def build_price_table(model, listings, min_listings=MIN_LISTINGS, km_step=KM_STEP, km_max=KM_MAX):
+    """Price every common configuration at every grid odometer reading in one batch."""
+    configs = common_configurations(listings, min_listings)
+    km_values = np.arange(0, km_max + 1, km_step)
+    grid = configs.loc[configs.index.repeat(len(km_values))].reset_index(drop=True)
+    grid['km_driven'] = np.tile(km_values, len(configs))
+    X = model.make_encoder().transform_sparse(grid[INPUT_FIELDS])
+    prices, low, high = model.predict_with_intervals(X, grid['name'].to_numpy())
+
+    shape = (len(configs), len(km_values))
+    table = PriceTable(configs.itertuples(index=False, name=None), km_step, np.reshape(prices, shape),
+                       None if low is None else np.reshape(low, shape),
+                       None if high is None else np.reshape(high, shape),
+                       model.version, {'min_listings': min_listings})
+    table.metadata['coverage'] = table_coverage(table, listings)
+    table.metadata['created_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    return table
+
+
+def main(argv=None):
+    import time
+
+    from cleaning import ListingCleaner, format_report
+    from ingest import load_listings
+    from model_store import MODEL_PATH, load_scorer
+
+    parser = argparse.ArgumentParser(
+        description="Precompute prices for the configurations listed most often, for O(1) lookups.")
+    parser.add_argument('--model', default=MODEL_PATH, help="Model artifact to price the table with")
+    parser.add_argument('--output', default=PRICE_TABLE_PATH)
+    parser.add_argument('--min-listings', type=int, default=MIN_LISTINGS,
+                        help="Listings a configuration needs to get a row in the table")
+    parser.add_argument('--km-step', type=int, default=KM_STEP)
+    parser.add_argument('--km-max', type=int, default=KM_MAX)
+    parser.add_argument('--check', action='store_true',
+                        help="Only report the existing table's coverage and staleness against --model")
+    args = parser.parse_args(argv)
+
+    model = load_scorer(args.model)
+    if args.check:
+        table = load_price_table(args.output)
+        if table is None:
+            print(f" No price table at {args.output}")
+            return
+    else:
+        cleaner = ListingCleaner()
+        listings = cleaner.clean(load_listings(CONFIG_FIELDS + ['km_driven', 'selling_price']))
+        print(format_report(cleaner.report))
+        started = time.perf_counter()
+        table = build_price_table(model, listings, args.min_listings, args.km_step, args.km_max)
+        elapsed = time.perf_counter() - started
+        table.save(args.output)
+        print(f" Priced {len(table.configs):,} configurations x {table.n_km} odometer readings "
+              f"({table.size:,} entries) in {elapsed:.2f}s -> {args.output}")
+
+    stats = table.stats(model.version)
+    coverage = stats['coverage']
+    print(f" Answers {coverage['name']:.1%} of listings by full name and {coverage['brand']:.1%} by brand")
+    if stats['stale']:
+        print(f" STALE: built for model {table.model_version} at {stats['created_at']}; "
+              f"{args.model} is version {model.version}, so every lookup falls back to the model")
+    else:
+        print(f" Current for model {model.version} (built {stats['created_at']})")
+
+
+if __name__ == '__main__':
+    main()
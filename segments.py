@@ -0,0 +1,272 @@
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from artifact import ArtifactError
+from encoder import FeatureEncoder, brand_of, name_keys
+from intervals import IntervalMixin
+from linear_scorer import LinearScorer
+
+# Brands are split into price tiers by their median listing price
+BRAND_GROUPS = ['budget', 'mid', 'premium', 'luxury']
+# Segment key used for the global model every router keeps resident
+GLOBAL_SEGMENT = '*'
+# Segments with fewer training rows than this are served by the global model
+MIN_SEGMENT_ROWS = 50
+# Segments are small and see few rows, so they are ridge-regularised; the
+# global model has enough data for plain least squares
+SEGMENT_CANDIDATE = {'model': 'ridge', 'alpha': 1.0, 'target': 'log'}
+GLOBAL_CANDIDATE = {'model': 'ols', 'alpha': None, 'target': 'log'}
+DEFAULT_MEMORY_MB = 64
+
+logger = logging.getLogger(__name__)
+
+
+def brand_groups(frame):
+    """{brand: price tier} from the median selling price of each brand's listings."""
+    import pandas as pd
+
+    brands = np.asarray(name_keys(frame['name'], 'brand')).astype(str)
+    medians = pd.Series(frame['selling_price'].to_numpy(dtype=float)).groupby(brands).median()
+    tiers = np.arange(len(medians)) * len(BRAND_GROUPS) // max(len(medians), 1)
+    order = medians.sort_values(kind='stable').index
+    return {str(brand): BRAND_GROUPS[tier] for brand, tier in zip(order, tiers)}
+
+
+def segment_key(name, fuel, transmission, groups):
+    group = groups.get(brand_of(name))
+    if group is None:
+        return GLOBAL_SEGMENT
+    return f'{group}|{fuel}|{transmission}'
+
+
+def _per_combination(frame, fn, dtype):
+    # fn(brand, fuel, transmission) evaluated once per distinct combination
+    # and broadcast back to every row
+    import pandas as pd
+
+    combos = pd.MultiIndex.from_arrays([np.asarray(name_keys(frame['name'], 'brand')).astype(str),
+                                        np.asarray(frame['fuel']).astype(str),
+                                        np.asarray(frame['transmission']).astype(str)])
+    codes, uniques = combos.factorize()
+    return np.array([fn(*combo) for combo in uniques], dtype=dtype)[codes]
+
+
+def segment_keys(frame, groups):
+    return _per_combination(frame, lambda brand, fuel, transmission: segment_key(brand, fuel, transmission, groups),
+                            object)
+
+
+def _fit_segment(task):
+    from model_search import column_scale, fit_candidate
+
+    key, candidate, X, y = task
+    coef, intercept = fit_candidate(candidate, X, y, column_scale(X))
+    return key, coef, intercept
+
+
+def fit_segments(X, y, keys, workers=None, min_rows=MIN_SEGMENT_ROWS, listings=None):
+    """Fit the global model and one model per large-enough segment in one process pool pass.
+
+    Rows are split by segment before they are sent, so each row is pickled
+    to exactly one segment task, plus once for the global fit. `listings`
+    marks the rows that are listings rather than derived copies (all of
+    them by default); only those count towards `min_rows` and the reported
+    sizes. Returns {segment key: (coef, intercept, training rows)}, global
+    model included.
+    """
+    keys = np.asarray(keys, dtype=object)
+    listings = np.ones(len(keys), dtype=bool) if listings is None else np.asarray(listings, dtype=bool)
+    segments, counts = np.unique(keys[listings], return_counts=True)
+    tasks = [(GLOBAL_SEGMENT, GLOBAL_CANDIDATE, X, y)]
+    rows = {GLOBAL_SEGMENT: int(listings.sum())}
+    for segment, count in zip(segments, counts):
+        if segment == GLOBAL_SEGMENT or count < min_rows:
+            continue
+        index = np.flatnonzero(keys == segment)
+        tasks.append((str(segment), SEGMENT_CANDIDATE, X[index], y[index]))
+        rows[str(segment)] = int(count)
+
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        fitted = list(pool.map(_fit_segment, tasks))
+    return {key: (coef, intercept, rows[key]) for key, coef, intercept in fitted}
+
+
+class SegmentBatch(namedtuple('SegmentBatch', ['X', 'segments'])):
+    # Encoded rows plus each row's segment id; shaped like the rows so callers
+    # that log the batch or feature width need not know about segments
+    __slots__ = ()
+
+    @property
+    def shape(self):
+        return self.X.shape
+
+
+class SegmentEncoder:
+    """FeatureEncoder output paired with each row's segment, for SegmentRouter.predict."""
+
+    def __init__(self, router):
+        self.router = router
+        self.encoder = FeatureEncoder(router.columns, router.name_encoding)
+        self.columns = self.encoder.columns
+        self.width = self.encoder.width
+
+    def transform(self, frame, sparse=False):
+        return SegmentBatch(self.encoder.transform(frame, sparse=sparse), self.router.segment_ids(frame))
+
+    def transform_sparse(self, frame):
+        return self.transform(frame, sparse=True)
+
+    def encode_one(self, sparse=False, **fields):
+        segment = self.router.segment_id(fields['name'], fields['fuel'], fields['transmission'])
+        return SegmentBatch(self.encoder.encode_one(sparse=sparse, **fields), np.array([segment]))
+
+
+class SegmentRouter(IntervalMixin):
+    """Routes each car to its segment's linear model, loading segments on demand.
+
+    Segments are brand price tier x fuel x transmission. Every segment's
+    coefficients sit over one shared vocabulary in a single artifact, which
+    stays memory-mapped; a segment's LinearScorer is built (and its array
+    checksummed) the first time a car needs it. Built scorers are kept in
+    LRU order and the least recently used are dropped once their estimated
+    footprint passes `max_bytes`. Cars whose brand was not seen in
+    training, or whose segment was too small to fit, use the global model,
+    which is always resident.
+    """
+
+    def __init__(self, columns, segments, coef_loader, intercepts, brand_groups, version=None, metadata=None,
+                 target='log', name_encoding='hashed', max_bytes=DEFAULT_MEMORY_MB * 2 ** 20):
+        self.columns = list(columns)
+        self.segments = list(segments)
+        self.segment_index = {key: i for i, key in enumerate(self.segments)}
+        self.intercepts = [float(i) for i in intercepts]
+        self.brand_groups = brand_groups
+        self.version = version
+        self.metadata = metadata or {}
+        self.target = target
+        self.name_encoding = name_encoding
+        self.max_bytes = max_bytes
+        self._coef_loader = coef_loader
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.global_id = self.segment_index[GLOBAL_SEGMENT]
+        self.global_model = self._build(self.global_id)
+
+    @classmethod
+    def from_artifact(cls, artifact, max_bytes=None):
+        if artifact.model.get('kind') != 'segmented':
+            raise ValueError(f"SegmentRouter cannot serve a '{artifact.model.get('kind')}' model")
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get('CAR_PRICE_SEGMENT_MEMORY_MB', DEFAULT_MEMORY_MB)) * 2 ** 20)
+        model = artifact.model
+        return cls(artifact.vocabulary, model['segments'], lambda i: artifact.checked_array(f'coef_{i}'),
+                   model['intercepts'], model['brand_groups'], artifact.version, artifact.metadata,
+                   model.get('target', 'log'), model.get('name_encoding', 'hashed'), max_bytes)
+
+    def _build(self, segment_id):
+        coef = self._coef_loader(segment_id)
+        if not np.isfinite(coef).all():
+            raise ArtifactError(f"segment {self.segments[segment_id]!r} has NaN or infinite coefficients")
+        return LinearScorer(self.columns, coef, self.intercepts[segment_id], self.version, self.metadata,
+                            self.target, self.name_encoding)
+
+    @staticmethod
+    def _footprint(scorer):
+        # Coefficient arrays plus the per-field lookup dicts; column names are
+        # shared with the router and not counted
+        return (scorer.coef_.nbytes + scorer.hash_coef.nbytes
+                + sum(sys.getsizeof(lookup) for lookup in scorer.category_coef.values()))
+
+    def scorer(self, segment_id):
+        if segment_id == self.global_id:
+            return self.global_model
+        with self._lock:
+            scorer = self._loaded.get(segment_id)
+            if scorer is not None:
+                self._loaded.move_to_end(segment_id)
+                self.hits += 1
+                return scorer
+            scorer = self._build(segment_id)
+            self._loaded[segment_id] = scorer
+            self.resident_bytes += self._footprint(scorer)
+            self.loads += 1
+            # Always keep the segment just loaded, even if it alone exceeds the cap
+            while self.resident_bytes > self.max_bytes and len(self._loaded) > 1:
+                evicted_id, evicted = self._loaded.popitem(last=False)
+                self.resident_bytes -= self._footprint(evicted)
+                self.evictions += 1
+                logger.debug("Evicted segment %s", self.segments[evicted_id])
+            return scorer
+
+    def segment_id(self, name, fuel, transmission):
+        key = segment_key(name, fuel, transmission, self.brand_groups)
+        return self.segment_index.get(key, self.global_id)
+
+    def segment_ids(self, frame):
+        return _per_combination(frame, self.segment_id, np.intp)
+
+    def scorer_for(self, name, fuel, transmission):
+        return self.scorer(self.segment_id(name, fuel, transmission))
+
+    def make_encoder(self):
+        return SegmentEncoder(self)
+
+    def _output(self, raw):
+        return np.exp(raw) if self.target == 'log' else raw
+
+    def raw_score(self, name, year, km_driven, fuel, seller_type, transmission, owner):
+        return self.scorer_for(name, fuel, transmission).raw_score(name, year, km_driven, fuel, seller_type,
+                                                                   transmission, owner)
+
+    def price(self, name, year, km_driven, fuel, seller_type, transmission, owner):
+        return self._output(self.raw_score(name, year, km_driven, fuel, seller_type, transmission, owner))
+
+    def price_grid(self, years, km_values, name, fuel, seller_type, transmission, owner):
+        return self.scorer_for(name, fuel, transmission).price_grid(years, km_values, name, fuel, seller_type,
+                                                                    transmission, owner)
+
+    def raw_score_frame(self, frame):
+        ids = self.segment_ids(frame)
+        scores = np.empty(len(ids))
+        for segment_id in np.unique(ids):
+            rows = np.flatnonzero(ids == segment_id)
+            scores[rows] = self.scorer(segment_id).raw_score_frame(frame.iloc[rows])
+        return scores
+
+    def predict_frame(self, frame):
+        return self._output(self.raw_score_frame(frame))
+
+    def raw_predict(self, batch):
+        # `batch` comes from make_encoder(): encoded rows plus their segment ids
+        X, ids = batch
+        scores = np.empty(X.shape[0])
+        for segment_id in np.unique(ids):
+            rows = np.flatnonzero(ids == segment_id)
+            scores[rows] = self.scorer(segment_id).raw_predict(X[rows])
+        return scores
+
+    def predict(self, batch):
+        return self._output(self.raw_predict(batch))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'segments': len(self.segments),
+                'loaded': len(self._loaded),
+                'resident_bytes': self.resident_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,263 @@
+import argparse
+import json
+import logging
+import math
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from encoder import CATEGORICAL_FEATURES, INPUT_FIELDS, NUMERIC_FEATURES
+from metrics import METRICS, SIZE_BUCKETS
+from model_registry import LOG_FORMAT, ModelRegistry
+from model_store import MODEL_PATH
+from price_table import PRICE_TABLE_PATH, PriceTableWatcher
+
+DEFAULT_MAX_WAIT_MS = 5
+DEFAULT_MAX_BATCH = 512
+
+
+class MicroBatcher:
+    """Collects concurrent prediction requests and scores them together.
+
+    Requests wait up to `max_wait_ms` for company; whatever has arrived by
+    then (or `max_batch` cars, whichever comes first) is stacked into one
+    sparse matrix and scored with a single predict call. Each batch takes
+    the registry's current model once, so a hot swap never splits a batch
+    across versions. Cars the price table covers for that version are
+    answered from it and only the rest reach the model; `tables` is a
+    PriceTableWatcher, so a rebuilt table is swapped in like the model.
+    """
+
+    def __init__(self, registry, max_wait_ms=DEFAULT_MAX_WAIT_MS, max_batch=DEFAULT_MAX_BATCH, tables=None):
+        self.registry = registry
+        self.tables = tables
+        self._encoder = (None, None)
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.rows = 0
+        self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._worker.start()
+
+    def encoder_for(self, model):
+        version, encoder = self._encoder
+        if version != model.version:
+            encoder = model.make_encoder()
+            self._encoder = (model.version, encoder)
+        return encoder
+
+    def submit(self, car):
+        future = Future()
+        self.queue.put((car, future))
+        return future
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    @property
+    def table(self):
+        return None if self.tables is None else self.tables.current()
+
+    def _score(self, model, cars):
+        # [(price, bound)] per car: from the price table where it answers, the model for the rest
+        table = self.table
+        with METRICS.stage('price_table'):
+            answers = [table.lookup(model.version, **car) if table is not None else None for car in cars]
+        misses = [i for i, answer in enumerate(answers) if answer is None]
+        METRICS.inc('price_table_hits_total', len(cars) - len(misses), model_version=model.version)
+        if misses:
+            columns = {field: [cars[i][field] for i in misses] for field in INPUT_FIELDS}
+            with METRICS.stage('encode'):
+                X = self.encoder_for(model).transform_sparse(columns)
+            with METRICS.stage('inference'):
+                prices, low, high = model.predict_with_intervals(X, columns['name'])
+            METRICS.set_gauge('encoded_feature_width', X.shape[1], model_version=model.version)
+            bounds = zip(low, high) if low is not None else [None] * len(misses)
+            for i, price, bound in zip(misses, prices, bounds):
+                answers[i] = (price, bound)
+        return [(float(price), bound and [float(b) for b in bound]) for price, bound in answers]
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            model = self.registry.current()
+            try:
+                results = self._score(model, [car for car, _ in batch])
+            except Exception:
+                # Rescore one car at a time, so a car the model chokes on
+                # fails only its own request and not the rest of the batch
+                results = []
+                for car, _ in batch:
+                    try:
+                        results.append(self._score(model, [car])[0])
+                    except Exception as exc:
+                        results.append(exc)
+            self.batches += 1
+            self.rows += len(batch)
+            METRICS.inc('predictions_total', len(batch), model_version=model.version)
+            METRICS.observe('batch_size', len(batch), SIZE_BUCKETS)
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+def parse_car(payload):
+    if not isinstance(payload, dict):
+        raise ValueError("each car must be a JSON object")
+    missing = [field for field in INPUT_FIELDS if field not in payload]
+    if missing:
+        raise ValueError(f"missing fields: {', '.join(missing)}")
+    car = {field: payload[field] for field in INPUT_FIELDS}
+    for field in CATEGORICAL_FEATURES:
+        if not isinstance(car[field], str):
+            raise ValueError(f"{field} must be a string")
+    for field in NUMERIC_FEATURES:
+        value = car[field]
+        # bool is an int subclass, and json.loads accepts NaN and Infinity
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f"{field} must be a finite number")
+    if car['year'] != int(car['year']):
+        raise ValueError("year must be a whole number")
+    if car['km_driven'] < 0:
+        raise ValueError("km_driven must not be negative")
+    car['year'] = int(car['year'])
+    car['km_driven'] = float(car['km_driven'])
+    return car
+
+
+class PredictionServer(ThreadingHTTPServer):
+    # The widget opens hundreds of connections at once; the default listen
+    # backlog of 5 would reset most of them before they reach the batcher
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    batcher = None
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            data = METRICS.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if self.path != '/health':
+            self._send_json(404, {'error': 'not found'})
+            return
+        health = {
+            'status': 'ok',
+            'batches': self.batcher.batches,
+            'rows': self.batcher.rows,
+            'model_version': self.batcher.registry.version,
+            'model_swaps': self.batcher.registry.swaps,
+        }
+        model = self.batcher.registry.current()
+        if hasattr(model, 'stats'):
+            # Segment router: which sub-models are resident and how much memory they hold
+            health['segments'] = model.stats()
+        table = self.batcher.table
+        if table is not None:
+            # Coverage of the listings, lookup hit rate, and whether it was built for the serving model
+            health['price_table'] = table.stats(model.version)
+            health['price_table']['swaps'] = self.batcher.tables.swaps
+        self._send_json(200, health)
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'null')
+            many = isinstance(payload, list)
+            cars = [parse_car(p) for p in (payload if many else [payload])]
+        except (ValueError, TypeError) as exc:
+            self._send_json(400, {'error': str(exc)})
+            return
+
+        started = time.perf_counter()
+        futures = [self.batcher.submit(car) for car in cars]
+        try:
+            results = [future.result() for future in futures]
+        except Exception as exc:
+            self._send_json(500, {'error': str(exc)})
+            return
+        METRICS.observe('stage_seconds', time.perf_counter() - started, stage='request')
+        prices = [price for price, _ in results]
+        bounds = [bound for _, bound in results]
+        if many:
+            self._send_json(200, {'prices': prices, 'intervals': bounds})
+        else:
+            self._send_json(200, {'price': prices[0], 'interval': bounds[0]})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host, port, model_path=MODEL_PATH,
+                max_wait_ms=DEFAULT_MAX_WAIT_MS, max_batch=DEFAULT_MAX_BATCH, table_path=PRICE_TABLE_PATH):
+    # The table is loaded before the first request, so no request pays for
+    # it, and reloaded whenever price_table.py rebuilds it
+    tables = PriceTableWatcher(table_path) if table_path else None
+    batcher = MicroBatcher(ModelRegistry(model_path), max_wait_ms, max_batch, tables)
+    handler = type('Handler', (PredictionHandler,), {'batcher': batcher})
+    return PredictionServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve car price predictions as JSON over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--model', default=MODEL_PATH, help="Model artifact to score with")
+    parser.add_argument('--max-wait-ms', type=float, default=DEFAULT_MAX_WAIT_MS,
+                        help="How long a request waits for others to batch with")
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument('--price-table', default=PRICE_TABLE_PATH,
+                        help="Precomputed prices from price_table.py; pass '' to always use the model")
+    args = parser.parse_args(argv)
+    # The registry logs the active model version and every swap at INFO
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+
+    server = make_server(args.host, args.port, args.model, args.max_wait_ms, args.max_batch, args.price_table)
+    batcher = server.RequestHandlerClass.batcher
+    print(f" Serving model {batcher.registry.version} on http://{args.host}:{args.port}/predict")
+    if batcher.table is not None:
+        stats = batcher.table.stats(batcher.registry.version)
+        print(f" Price table: {stats['configurations']:,} configurations"
+              + (f", STALE (built for model {stats['model_version']})" if stats['stale'] else ""))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
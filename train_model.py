@@ -1,23 +1,358 @@
-import pandas as pd
+import argparse
 import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.linear_model import LinearRegression
-import pickle
+from encoder import FeatureEncoder, HASH_BUCKETS, build_columns, brand_of, with_name_prefixes
+from artifact import save_linear_model, save_gbm_model, save_segmented_model, load_artifact, file_sha256, ARTIFACT_PATH
+from ingest import load_listings, iter_listings, read_listings, CSV_PATH
+from incremental import NormalEquationState, STATE_PATH
+from linear_scorer import LinearScorer
+import intervals
+import model_search
+import gbm
+import segments
+from tree_scorer import TREE_FEATURES
+from cleaning import ListingCleaner, format_report
 
-data = pd.read_csv("cardetails.csv.csv")
+TRAINING_COLUMNS = ["name", "year", "selling_price", "km_driven", "fuel", "seller_type", "transmission", "owner"]
+HOLDOUT_FRACTION = 0.2
+SPLIT_SEED = 42
+# The brand-only check covers brands with this many listings and
+# warns when a brand's mean prediction is further than this from its mean price
+BRAND_CHECK_ROWS = 20
+BRAND_CHECK_TOLERANCE = 0.25
 
 
-data = pd.get_dummies(data, drop_first=True)
+def regression_metrics(y_true, y_pred):
+    residuals = y_true - y_pred
+    return {
+        "rmse": float(np.sqrt(np.mean(residuals ** 2))),
+        "mae": float(np.mean(np.abs(residuals))),
+        "r2": float(1 - np.sum(residuals ** 2) / np.sum((y_true - y_true.mean()) ** 2)),
+    }
 
-X = data.drop("selling_price", axis=1)
-y = data["selling_price"]
 
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+def brand_only_check(predict, listings, min_rows=BRAND_CHECK_ROWS, tolerance=BRAND_CHECK_TOLERANCE):
+    # The app asks by brand alone, so every listing is re-scored under its
+    # brand name and each brand's mean prediction compared with its mean
+    # price. All listings rather than the holdout: the holdout has too few
+    # rows per brand for the means to be stable
+    brands = listings["name"].map(brand_of).astype(str)
+    predicted = predict(listings.assign(name=brands.to_numpy()))
+    frame = listings.assign(brand=brands.to_numpy(), predicted=predicted)
+    means = frame.groupby("brand")[["selling_price", "predicted"]].mean()
+    means = means[frame.groupby("brand").size() >= min_rows]
+    errors = (means["predicted"] / means["selling_price"] - 1).to_dict()
+    for brand, error in sorted(errors.items()):
+        if abs(error) > tolerance:
+            print(f" WARNING: brand-only predictions for {brand} average {error:+.0%} off its mean price")
+    worst = max(errors, key=lambda brand: abs(errors[brand]), default=None)
+    return {"brands": len(errors), "worst_brand": worst,
+            "worst_error": None if worst is None else float(errors[worst])}
 
-model = LinearRegression()
-model.fit(X_train, y_train)
 
-with open("model.pkl", "wb") as f:
-    pickle.dump(model, f)
+def train_full(data, coverage=intervals.DEFAULT_COVERAGE, name_encoding="hashed", hash_buckets=HASH_BUCKETS):
+    # Sparse one-hot design matrix: a handful of non-zeros per row instead of
+    # ~1,500 dense dummy columns, so memory grows with rows, not rows x columns.
+    # Hashed names keep the width fixed however many variants the data holds
+    columns = build_columns(data, drop_first=True, name_encoding=name_encoding, hash_buckets=hash_buckets)
+    encoder = FeatureEncoder(columns, name_encoding)
 
-print(" Model trained and saved as model.pkl")
+    y = data["selling_price"].to_numpy(dtype=float)
+    train_idx, test_idx = train_test_split(np.arange(len(y)), test_size=HOLDOUT_FRACTION, random_state=SPLIT_SEED)
+    train = data.iloc[train_idx]
+    if name_encoding == "hashed":
+        # Brand and brand + model copies of each row identify the shorter tokens
+        train = with_name_prefixes(train)
+    X_train, y_train = encoder.transform(train, sparse=True), train["selling_price"].to_numpy(dtype=float)
+    X_test, y_test = encoder.transform(data.iloc[test_idx], sparse=True), y[test_idx]
+
+    # LinearRegression solves sparse input with LSQR; the tight tolerance lets it
+    # converge despite year/km_driven being on a very different scale to the dummies
+    model = LinearRegression(tol=1e-10)
+    model.fit(X_train, y_train)
+
+    # Interval quantiles come from the holdout residuals, which the fit never saw
+    y_pred = model.predict(X_test)
+    brands = data["name"].iloc[test_idx].map(brand_of)
+    metadata = {
+        "training_rows": len(train_idx),
+        "metrics": {"holdout": regression_metrics(y_test, y_pred),
+                    "brand_only": brand_only_check(lambda frame: model.predict(encoder.transform(frame, sparse=True)),
+                                                   data)},
+        "intervals": intervals.residual_quantiles(y_test - y_pred, brands, coverage),
+    }
+    return {"columns": columns, "coef": model.coef_, "intercept": model.intercept_, "metadata": metadata,
+            "name_encoding": name_encoding}
+
+
+def train_gbm(data, coverage=intervals.DEFAULT_COVERAGE):
+    # Gradient-boosted trees on log price over integer-coded categoricals;
+    # same holdout split as train_full, so the metrics are comparable
+    y = data["selling_price"].to_numpy(dtype=float)
+    train_idx, test_idx = train_test_split(np.arange(len(y)), test_size=HOLDOUT_FRACTION, random_state=SPLIT_SEED)
+    train, test = data.iloc[train_idx], data.iloc[test_idx]
+    scorer, categories, trees, baseline, max_depth = gbm.fit_gbm(train, np.log(y[train_idx]))
+
+    raw = scorer.raw_score_frame(test)
+    brands = test["name"].map(brand_of)
+    print(f" Fitted {scorer.n_trees} trees of depth <= {max_depth} on {len(train_idx):,} listings")
+    metadata = {
+        "training_rows": len(train_idx),
+        "trees": scorer.n_trees,
+        "metrics": {"holdout": regression_metrics(y[test_idx], np.exp(raw)),
+                    "brand_only": brand_only_check(lambda frame: np.exp(scorer.raw_score_frame(frame)), data)},
+        "intervals": intervals.residual_quantiles(np.log(y[test_idx]) - raw, brands, coverage),
+    }
+    return {"kind": "gbm", "columns": TREE_FEATURES, "trees": trees, "baseline": baseline, "max_depth": max_depth,
+            "categories": categories, "metadata": metadata, "target": "log"}
+
+
+def train_segmented(data, coverage=intervals.DEFAULT_COVERAGE, workers=None, min_rows=segments.MIN_SEGMENT_ROWS,
+                    name_encoding="hashed", hash_buckets=HASH_BUCKETS):
+    # A global model plus one per brand tier x fuel x transmission segment,
+    # all over one vocabulary and fitted in a single process pool pass
+    columns = build_columns(data, drop_first=True, name_encoding=name_encoding, hash_buckets=hash_buckets)
+    y = data["selling_price"].to_numpy(dtype=float)
+    train_idx, test_idx = train_test_split(np.arange(len(y)), test_size=HOLDOUT_FRACTION, random_state=SPLIT_SEED)
+    train, test = data.iloc[train_idx], data.iloc[test_idx]
+
+    groups = segments.brand_groups(train)
+    # Prefix copies share their listing's brand, so they land in the same segment
+    fit_rows = with_name_prefixes(train) if name_encoding == "hashed" else train
+    X_fit = FeatureEncoder(columns, name_encoding).transform_sparse(fit_rows)
+    y_fit = fit_rows["selling_price"].to_numpy(dtype=float)
+    fitted = segments.fit_segments(X_fit, y_fit, segments.segment_keys(fit_rows, groups), workers, min_rows,
+                                   listings=np.arange(len(fit_rows)) < len(train))
+    # Global model first, then segments in key order
+    keys = [segments.GLOBAL_SEGMENT] + sorted(k for k in fitted if k != segments.GLOBAL_SEGMENT)
+    coefs = [fitted[k][0] for k in keys]
+    intercepts = [fitted[k][1] for k in keys]
+    router = segments.SegmentRouter(columns, keys, coefs.__getitem__, intercepts, groups,
+                                    name_encoding=name_encoding)
+
+    raw = router.raw_score_frame(test)
+    y_test = y[test_idx]
+    served_by = np.asarray(keys, dtype=object)[router.segment_ids(test)]
+    per_segment = {}
+    for key in keys:
+        rows = served_by == key
+        per_segment[key] = {"training_rows": fitted[key][2], "holdout_rows": int(rows.sum())}
+        if rows.any():
+            per_segment[key]["holdout"] = regression_metrics(y_test[rows], np.exp(raw[rows]))
+    print(f" Fitted a global model and {len(keys) - 1} segment models "
+          f"({int((served_by != segments.GLOBAL_SEGMENT).sum()):,} of {len(test_idx):,} holdout rows routed to a segment)")
+    metadata = {
+        "training_rows": len(train_idx),
+        "metrics": {"holdout": regression_metrics(y_test, np.exp(raw)),
+                    "brand_only": brand_only_check(lambda frame: np.exp(router.raw_score_frame(frame)), data)},
+        "segments": per_segment,
+        "intervals": intervals.residual_quantiles(np.log(y_test) - raw, test["name"].map(brand_of), coverage),
+    }
+    return {"kind": "segmented", "columns": columns, "segments": keys, "coefs": coefs, "intercepts": intercepts,
+            "brand_groups": groups, "metadata": metadata, "target": "log", "name_encoding": name_encoding}
+
+
+def train_incremental(data, state_path=STATE_PATH, name_encoding="hashed", hash_buckets=HASH_BUCKETS, seen=None):
+    # Fold the new listings into the saved XᵀX / Xᵀy and re-solve; history is
+    # never re-read or re-encoded. An existing state keeps its own name encoding.
+    # `seen` is the cleaner's row hashes, kept with the state for the next batch
+    try:
+        state = NormalEquationState.load(state_path)
+    except FileNotFoundError:
+        state = NormalEquationState(name_encoding=name_encoding, hash_buckets=hash_buckets)
+    added = state.partial_fit(data)
+    if seen is not None:
+        state.seen = seen
+    intercept, coef = state.solve()
+    state.save(state_path)
+
+    print(f" Added {len(data):,} listings ({len(added)} new columns); "
+          f"state now holds {state.n_listings:,} listings x {state.width:,} columns")
+    metadata = {
+        "training_rows": state.n_listings,
+        "metrics": {"train": {"rmse": state.rmse(intercept, coef)}},
+    }
+    return {"columns": list(state.columns), "coef": coef, "intercept": intercept, "metadata": metadata,
+            "name_encoding": state.name_encoding, "calibration": state.sample}
+
+
+def train_streaming(path, chunk_size=100000, vocabulary=None, state_path=None, cleaner=None,
+                    name_encoding="hashed", hash_buckets=HASH_BUCKETS):
+    # Each chunk is encoded and added to the XᵀX / Xᵀy accumulators, then
+    # dropped, so the fit's memory depends on the chunk size, not the file
+    # size. A cleaner adds per-row state (duplicate hashes, and the price
+    # statistics pass) that does grow with the file
+    state = NormalEquationState(vocabulary, name_encoding=name_encoding, hash_buckets=hash_buckets)
+    if cleaner is not None:
+        # A first pass for the brand price statistics, so outliers are judged
+        # against the whole file and the kept rows don't depend on the chunk size
+        cleaner.fit(iter_listings(path, chunk_size, TRAINING_COLUMNS))
+    chunks = 0
+    for chunk in iter_listings(path, chunk_size, TRAINING_COLUMNS):
+        if cleaner is not None:
+            chunk = cleaner.clean(chunk)
+        state.partial_fit(chunk, grow=vocabulary is None)
+        chunks += 1
+    intercept, coef = state.solve()
+    if state_path:
+        state.save(state_path)
+
+    print(f" Streamed {state.n_listings:,} listings in {chunks} chunks of up to {chunk_size:,} rows "
+          f"({state.width:,} columns)")
+    metadata = {
+        "training_rows": state.n_listings,
+        "chunks": chunks,
+        "metrics": {"train": {"rmse": state.rmse(intercept, coef)}},
+    }
+    return {"columns": list(state.columns), "coef": coef, "intercept": intercept, "metadata": metadata,
+            "name_encoding": state.name_encoding}
+
+
+def train_search(data, folds=5, workers=None):
+    # k-fold CV over OLS/ridge/lasso, price vs log-price targets and full-name
+    # vs brand encodings, run across a process pool; the winner is refit on all rows
+    leaderboard, encoders, matrices, origins = model_search.search(data, folds, workers)
+    y = data["selling_price"].to_numpy(dtype=float)
+    best, columns, coef, intercept = model_search.fit_best(leaderboard, encoders, matrices, y, origins)
+    encoder = encoders[best["name_encoding"]]
+
+    for row in leaderboard[:5]:
+        alpha = "" if row["alpha"] is None else f" alpha={row['alpha']:g}"
+        print(f" {row['model']}{alpha} target={row['target']} names={row['name_encoding']}: "
+              f"CV RMSE {row['cv_rmse']:,.0f} (+/- {row['cv_rmse_std']:,.0f})")
+    metadata = {
+        "training_rows": len(y),
+        "candidate": {k: best[k] for k in ("model", "alpha", "target", "name_encoding")},
+        "metrics": {"cv": {"folds": folds, "rmse": best["cv_rmse"], "rmse_std": best["cv_rmse_std"],
+                           "mae": best["cv_mae"]},
+                    "brand_only": brand_only_check(
+                        lambda frame: model_search.predict_price(best, coef, intercept, encoder.transform_sparse(frame)),
+                        data)},
+        "leaderboard": leaderboard[:10],
+    }
+    return {"columns": columns, "coef": coef, "intercept": intercept, "metadata": metadata,
+            "target": best["target"], "name_encoding": best["name_encoding"]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the car price model.")
+    parser.add_argument("--data", help="Listings file to train on (CSV, Parquet or Arrow); defaults to cardetails.csv.csv")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Fold --data into the saved normal-equation state instead of refitting from scratch")
+    parser.add_argument("--state", default=STATE_PATH, help="Where the incremental training state is kept")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read --data in chunks into normal-equation accumulators; the fit's memory is bounded by --chunk-size")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="Rows per chunk for --stream")
+    parser.add_argument("--vocabulary-from",
+                        help="With --stream, reuse this artifact's feature columns instead of growing them from the data")
+    parser.add_argument("--search", action="store_true",
+                        help="Cross-validate a grid of models, targets and encodings in parallel and keep the best")
+    parser.add_argument("--folds", type=int, default=5, help="Cross-validation folds for --search")
+    parser.add_argument("--workers", type=int, help="Worker processes for --search and --model segmented (default: all cores)")
+    parser.add_argument("--model", choices=["linear", "gbm", "segmented"], default="linear",
+                        help="Model family to fit; gbm trains gradient-boosted trees on log price, segmented fits "
+                             "one linear model per brand tier x fuel x transmission plus a global fallback")
+    parser.add_argument("--min-segment-rows", type=int, default=segments.MIN_SEGMENT_ROWS,
+                        help="Segments with fewer training rows are served by the global model")
+    parser.add_argument("--name-encoding", choices=["hashed", "full"], default="hashed",
+                        help="Encode names as hashed brand/model/variant tokens (fixed width) or one column per name")
+    parser.add_argument("--hash-buckets", type=int, default=HASH_BUCKETS,
+                        help="Hash buckets for --name-encoding hashed; the model's name columns are fixed at this")
+    parser.add_argument("--no-clean", action="store_true",
+                        help="Train on every row, skipping validation, de-duplication and outlier filtering")
+    parser.add_argument("--coverage", type=float, default=intervals.DEFAULT_COVERAGE,
+                        help="Coverage of the prediction intervals stored with the model")
+    parser.add_argument("--output", default=ARTIFACT_PATH, help="Model artifact to write")
+    args = parser.parse_args(argv)
+
+    if sum([args.incremental, args.search, args.stream]) > 1:
+        parser.error("--incremental, --search and --stream cannot be combined")
+    if args.model != "linear" and (args.incremental or args.search or args.stream):
+        parser.error(f"--model {args.model} only supports a full fit")
+
+    # Streamed chunks share one cleaner, so duplicates are caught across chunks too;
+    # incremental batches are also checked against every batch already folded in
+    cleaner = None
+    if not args.no_clean:
+        cleaner = ListingCleaner(seen=NormalEquationState.load_seen(args.state) if args.incremental else None)
+    if args.stream:
+        vocabulary, name_encoding = None, args.name_encoding
+        if args.vocabulary_from:
+            # The columns only mean something together with the encoding that built them
+            source = load_artifact(args.vocabulary_from)
+            kind = source.model.get("kind")
+            if kind not in ("linear", "segmented"):
+                parser.error(f"--vocabulary-from needs a linear model's columns, not a '{kind}' model")
+            vocabulary, name_encoding = source.vocabulary, source.model.get("name_encoding", "full")
+        mode, result = "stream", train_streaming(args.data or CSV_PATH, args.chunk_size, vocabulary,
+                                                 cleaner=cleaner, name_encoding=name_encoding,
+                                                 hash_buckets=args.hash_buckets)
+    else:
+        if args.data:
+            data = read_listings(args.data)[TRAINING_COLUMNS]
+        else:
+            data = load_listings(TRAINING_COLUMNS)
+        if cleaner is not None:
+            data = cleaner.clean(data)
+
+        if args.incremental and data.empty:
+            # Every listing is already in the state; the saved model still stands
+            if cleaner is not None:
+                print(format_report(cleaner.report))
+            print(f" No new listings to add; {args.state} and {args.output} are unchanged")
+            return
+        if args.incremental:
+            mode, result = "incremental", train_incremental(data, args.state, args.name_encoding, args.hash_buckets,
+                                                            None if cleaner is None else cleaner.seen_hashes)
+        elif args.search:
+            mode, result = "search", train_search(data, args.folds, args.workers)
+        elif args.model == "gbm":
+            mode, result = "full", train_gbm(data, args.coverage)
+        elif args.model == "segmented":
+            mode, result = "full", train_segmented(data, args.coverage, args.workers, args.min_segment_rows,
+                                                   args.name_encoding, args.hash_buckets)
+        else:
+            mode, result = "full", train_full(data, args.coverage, args.name_encoding, args.hash_buckets)
+
+    metadata = result["metadata"]
+    if cleaner is not None:
+        print(format_report(cleaner.report))
+        metadata["cleaning"] = cleaner.report
+    if "intervals" not in metadata:
+        # Only the full fit keeps a holdout; the other modes calibrate on the
+        # rows they trained on, so their intervals are somewhat optimistic.
+        # Incremental runs use the state's sample of every batch so far, not
+        # just today's, so one small batch cannot erase the per-brand quantiles
+        scorer = LinearScorer(result["columns"], result["coef"], result["intercept"],
+                              target=result.get("target", "price"),
+                              name_encoding=result.get("name_encoding", "full"))
+        if args.stream:
+            frames = iter_listings(args.data or CSV_PATH, args.chunk_size, TRAINING_COLUMNS)
+            if cleaner is not None:
+                recheck = ListingCleaner(cleaner.reference_year)
+                recheck.fit(iter_listings(args.data or CSV_PATH, args.chunk_size, TRAINING_COLUMNS))
+                frames = (recheck.clean(chunk) for chunk in frames)
+        elif result.get("calibration") is not None:
+            frames = [result["calibration"]]
+        else:
+            frames = [data]
+        metadata["intervals"] = intervals.calibrate(scorer, frames, args.coverage)
+        metadata["intervals"]["source"] = "train"
+    metadata["dataset_sha256"] = file_sha256(args.data or CSV_PATH)
+    metadata["mode"] = mode
+    if result.get("kind") == "segmented":
+        header = save_segmented_model(args.output, result["columns"], result["segments"], result["coefs"],
+                                      result["intercepts"], result["brand_groups"], metadata, result["target"],
+                                      result["name_encoding"])
+    elif result.get("kind") == "gbm":
+        header = save_gbm_model(args.output, result["columns"], result["trees"], result["baseline"],
+                                result["max_depth"], result["categories"], metadata, result["target"])
+    else:
+        header = save_linear_model(args.output, result["columns"], result["coef"], result["intercept"], metadata,
+                                   result.get("target", "price"), result.get("name_encoding", "full"))
+    print(f" Model trained and saved as {args.output} (version {header['version']})")
+
+
+if __name__ == "__main__":
+    main()
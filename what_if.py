@@ -0,0 +1,32 @@
+import numpy as np
+
+from encoder import INPUT_FIELDS
+
+DEFAULT_KM_VALUES = [0, 25000, 50000, 100000, 150000, 200000]
+
+
+def price_grid(model, car, years, km_values=DEFAULT_KM_VALUES):
+    """Predicted price of `car` for every year x km_driven combination.
+
+    Linear models answer from one base score (LinearScorer.price_grid); any
+    other model gets the grid stacked into a single batch prediction.
+    """
+    fields = {k: v for k, v in car.items() if k not in ('year', 'km_driven')}
+    if hasattr(model, 'price_grid'):
+        return model.price_grid(years, km_values, **fields)
+
+    import pandas as pd
+    year_grid, km_grid = np.meshgrid(np.asarray(years), np.asarray(km_values), indexing='ij')
+    frame = pd.DataFrame({field: fields.get(field) for field in INPUT_FIELDS
+                          if field not in ('year', 'km_driven')}, index=range(year_grid.size))
+    frame['year'] = year_grid.ravel()
+    frame['km_driven'] = km_grid.ravel()
+    return np.asarray(model.predict_frame(frame[INPUT_FIELDS])).reshape(year_grid.shape)
+
+
+def grid_chart_data(grid, years, km_values):
+    # Column-per-km layout for st.line_chart with the year on the x axis
+    data = {'year': [int(y) for y in years]}
+    for j, km in enumerate(km_values):
+        data[f'{int(km):,} km'] = [float(p) for p in grid[:, j]]
+    return data